@@ -5,10 +5,28 @@ from pyformlang.finite_automaton import (
     FiniteAutomaton,
     EpsilonNFA,
     State,
+    Symbol,
 )
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from networkx import MultiDiGraph
-from typing import Set, Any, Union, KeysView, TypeVar, Dict, List
+from typing import (
+    Set,
+    Any,
+    KeysView,
+    TypeVar,
+    Dict,
+    List,
+    Iterable,
+    Tuple,
+    Callable,
+)
 from scipy import sparse
+from scipy.sparse import csgraph
+import numpy as np
+
+import project.matrix_backend as mb
+from project.index_pairs import IndexPairs
 
 
 def dfa_from_regex(regexp: str) -> DeterministicFiniteAutomaton:
@@ -17,23 +35,70 @@ def dfa_from_regex(regexp: str) -> DeterministicFiniteAutomaton:
     return dfa
 
 
-def _set_nodes_flag(
-    graph: MultiDiGraph, flag: str, nodes: Union[Set[Any], None]
-) -> None:
-    nodes = graph.nodes if nodes is None else nodes
-    graph.nodes(data=flag, default=False)
-    for node in nodes:
-        graph.nodes[node][flag] = True
-
-
 def nfa_from_graph(
     graph: MultiDiGraph, start_nodes: Set[Any] = None, final_nodes: Set[Any] = None
 ) -> NondeterministicFiniteAutomaton:
-    _set_nodes_flag(graph, "is_start", start_nodes)
-    _set_nodes_flag(graph, "is_final", final_nodes)
+    return BooleanDecomposition.from_graph(graph, start_nodes, final_nodes).compose(
+        NondeterministicFiniteAutomaton
+    )
+
 
-    nfa = NondeterministicFiniteAutomaton.from_networkx(graph)
-    return nfa
+def _bool_csr(rows, cols, states_count: int) -> sparse.csr_matrix:
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    return sparse.coo_matrix(
+        (np.ones(rows.size, dtype=bool), (rows, cols)),
+        shape=(states_count, states_count),
+    ).tocsr()
+
+
+def _label_pool(workers: int, labels_count: int):
+    """
+    Pool of workers threads to map labels in, or a context giving None if
+    the labels are better mapped sequentially. It is created once per query,
+    so that threads are not started anew on every iteration.
+    """
+    if workers is None or workers <= 1 or labels_count <= 1:
+        return nullcontext()
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def _map_labels(
+    function: Callable, labels: List, executor: ThreadPoolExecutor = None
+) -> List:
+    """
+    Applies function to every label, in the executor's threads if given:
+    scipy and numpy release the GIL in matrix products, so they run in
+    parallel.
+    """
+    if executor is None:
+        return [function(label) for label in labels]
+    return list(executor.map(function, labels))
+
+
+def build_label_matrices(
+    transitions: Iterable[Tuple[int, Any, int]], states_count: int
+) -> Dict[Any, sparse.csr_matrix]:
+    label_codes = {}
+    sources, codes, destinations = [], [], []
+    for source, label, destination in transitions:
+        sources.append(source)
+        codes.append(label_codes.setdefault(label, len(label_codes)))
+        destinations.append(destination)
+
+    sources = np.asarray(sources, dtype=np.int64)
+    destinations = np.asarray(destinations, dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(label_codes) + 1))
+
+    label_matrices = {}
+    for label, code in label_codes.items():
+        selected = order[bounds[code] : bounds[code + 1]]
+        label_matrices[label] = _bool_csr(
+            sources[selected], destinations[selected], states_count
+        )
+    return label_matrices
 
 
 class BooleanDecomposition:
@@ -52,35 +117,69 @@ class BooleanDecomposition:
         self.__start_states = start_states
         self.__final_states = final_states
         self.__states = states
+        self.__start_mask = None
+        self.__final_mask = None
 
     @staticmethod
     def from_fa(fa: FiniteAutomaton):
-        label_matrices = {}
-        states_count = len(fa.states)
-        states_indices = {state: ind for (ind, state) in enumerate(fa.states)}
-
-        for source, transitions_from_source in fa.to_dict().items():
-            for label, destinations in transitions_from_source.items():
-                if not isinstance(destinations, set):
-                    destinations = {destinations}
-
-                for destination in destinations:
-                    if label not in label_matrices:
-                        label_matrices[label] = sparse.dok_matrix(
-                            (states_count, states_count), dtype=bool
-                        )
-                    source_ind = states_indices[source]
-                    destination_ind = states_indices[destination]
-                    label_matrices[label][source_ind, destination_ind] = True
+        states = list(fa.states)
+        states_indices = {state: ind for (ind, state) in enumerate(states)}
+
+        transitions = (
+            (states_indices[source], label, states_indices[destination])
+            for source, label, destination in fa
+        )
 
         return BooleanDecomposition(
             states_indices,
-            label_matrices,
-            list(fa.states),
+            build_label_matrices(transitions, len(states)),
+            states,
             fa.start_states,
             fa.final_states,
         )
 
+    @staticmethod
+    def from_graph(
+        graph: MultiDiGraph,
+        start_nodes: Set[Any] = None,
+        final_nodes: Set[Any] = None,
+    ):
+        states = [State(node) for node in graph.nodes]
+        nodes_indices = {node: ind for (ind, node) in enumerate(graph.nodes)}
+
+        transitions = (
+            (nodes_indices[source], Symbol(label), nodes_indices[destination])
+            for source, destination, label in graph.edges(data="label")
+            if label is not None
+        )
+
+        start_nodes = graph.nodes if start_nodes is None else start_nodes
+        final_nodes = graph.nodes if final_nodes is None else final_nodes
+
+        return BooleanDecomposition(
+            {state: ind for (ind, state) in enumerate(states)},
+            build_label_matrices(transitions, len(states)),
+            states,
+            {State(node) for node in start_nodes},
+            {State(node) for node in final_nodes},
+        )
+
+    def with_states(
+        self, start_states: Set[T] = None, final_states: Set[T] = None
+    ) -> "BooleanDecomposition":
+        """
+        Decomposition sharing states and label matrices with this one, but
+        with its own start and final states (all states if not given).
+        """
+        all_states = set(self.__states)
+        return BooleanDecomposition(
+            self.__states_indices,
+            self.__label_matrices,
+            self.__states,
+            all_states if start_states is None else start_states,
+            all_states if final_states is None else final_states,
+        )
+
     def __getitem__(self, label: Any):
         return self.__label_matrices[label]
 
@@ -93,9 +192,20 @@ class BooleanDecomposition:
 
     @property
     def adjacency_matrix(self):
-        if len(self.labels) == 0:
-            return sparse.csr_matrix((0, 0), dtype=bool)
-        return sum(self.__label_matrices.values())
+        return mb.SparseBackend.union(
+            [sparse.csr_matrix(matrix) for matrix in self.__label_matrices.values()],
+            (self.states_count, self.states_count),
+        )
+
+    @property
+    def nnz(self) -> int:
+        """Number of transitions, counting parallel ones with distinct labels."""
+        return sum(matrix.nnz for matrix in self.__label_matrices.values())
+
+    @property
+    def backend(self):
+        """Matrix backend suiting the density of the decomposition."""
+        return mb.choose_backend((self.states_count, self.states_count), self.nnz)
 
     @property
     def items(self):
@@ -105,6 +215,10 @@ class BooleanDecomposition:
     def states(self) -> List[T]:
         return self.__states
 
+    @property
+    def states_count(self) -> int:
+        return len(self.__states)
+
     @property
     def start_states(self) -> Set[T]:
         return self.__start_states
@@ -113,57 +227,143 @@ class BooleanDecomposition:
     def final_states(self) -> Set[T]:
         return self.__final_states
 
+    @property
+    def start_mask(self) -> np.ndarray:
+        if self.__start_mask is None:
+            self.__start_mask = self._states_mask(self.__start_states)
+        return self.__start_mask
+
+    @property
+    def final_mask(self) -> np.ndarray:
+        if self.__final_mask is None:
+            self.__final_mask = self._states_mask(self.__final_states)
+        return self.__final_mask
+
+    def _states_mask(self, states: Set[T]) -> np.ndarray:
+        mask = np.zeros(self.states_count, dtype=bool)
+        indices = [
+            self.__states_indices[state]
+            for state in states
+            if state in self.__states_indices
+        ]
+        mask[indices] = True
+        return mask
+
+    def state_at(self, index: int) -> T:
+        return self.__states[index]
+
     def index_of(self, state: Any) -> int:
         return self.__states_indices[state]
 
-    def compose(self) -> FiniteAutomaton:
-        fa = EpsilonNFA()
+    def compose(self, automaton_type=EpsilonNFA) -> FiniteAutomaton:
+        """Automaton of the given pyformlang class with the decomposed transitions."""
+        fa = automaton_type()
+        states = self.states
 
-        for label, matrix in self.__label_matrices.items():
+        for label, matrix in self.items:
             rows, cols = matrix.nonzero()
             for row, col in zip(rows, cols):
-                source = self.__states[row]
-                dest = self.__states[col]
+                source = states[row]
+                dest = states[col]
                 fa.add_transition(source, label, dest)
 
-        for state in self.__start_states:
+        for state in self.start_states:
             fa.add_start_state(state)
-        for state in self.__final_states:
+        for state in self.final_states:
             fa.add_final_state(state)
 
         return fa
 
 
+class ProductDecomposition(BooleanDecomposition):
+    """
+    Boolean decomposition of the intersection of two automata.
+
+    The product state of the i-th state of the first operand and the j-th
+    state of the second one has index i * |Q2| + j, so states are never
+    materialized unless they are explicitly requested.
+    """
+
+    def __init__(
+        self,
+        fa1: BooleanDecomposition,
+        fa2: BooleanDecomposition,
+        label_matrices,
+    ):
+        super().__init__({}, label_matrices, [], set(), set())
+        self.__fa1 = fa1
+        self.__fa2 = fa2
+        self.__states = None
+        self.__start_states = None
+        self.__final_states = None
+        self.__start_mask = np.kron(fa1.start_mask, fa2.start_mask)
+        self.__final_mask = np.kron(fa1.final_mask, fa2.final_mask)
+
+    @property
+    def operands(self) -> Tuple[BooleanDecomposition, BooleanDecomposition]:
+        return self.__fa1, self.__fa2
+
+    @property
+    def states(self) -> List[State]:
+        if self.__states is None:
+            self.__states = [self.state_at(ind) for ind in range(self.states_count)]
+        return self.__states
+
+    @property
+    def states_count(self) -> int:
+        return self.__fa1.states_count * self.__fa2.states_count
+
+    @property
+    def start_mask(self) -> np.ndarray:
+        return self.__start_mask
+
+    @property
+    def final_mask(self) -> np.ndarray:
+        return self.__final_mask
+
+    @property
+    def start_states(self) -> Set[State]:
+        if self.__start_states is None:
+            self.__start_states = self._states_of(self.start_mask)
+        return self.__start_states
+
+    @property
+    def final_states(self) -> Set[State]:
+        if self.__final_states is None:
+            self.__final_states = self._states_of(self.final_mask)
+        return self.__final_states
+
+    def _states_of(self, mask: np.ndarray) -> Set[State]:
+        return {self.state_at(ind) for ind in np.flatnonzero(mask)}
+
+    def split_indices(self, indices) -> Tuple[np.ndarray, np.ndarray]:
+        return np.divmod(np.asarray(indices), self.__fa2.states_count)
+
+    def state_at(self, index: int) -> State:
+        ind1, ind2 = divmod(int(index), self.__fa2.states_count)
+        state1 = self.__fa1.states[ind1]
+        state2 = self.__fa2.states[ind2]
+        return State((state1.value, state2.value))
+
+    def index_of(self, state: State) -> int:
+        value1, value2 = state.value
+        return self.__fa2.states_count * self.__fa1.index_of(
+            State(value1)
+        ) + self.__fa2.index_of(State(value2))
+
+
 def intersect_boolean(
     fa1: "BooleanDecomposition", fa2: "BooleanDecomposition"
-) -> "BooleanDecomposition":
-    states_count2 = len(fa2.states)
+) -> "ProductDecomposition":
     labels = fa1.labels & fa2.labels
 
     intersected_label_matrices = {}
-    states_indices = {}
-    start_states = set()
-    final_states = set()
-
     for label in labels:
-        intersected_label_matrices[label] = sparse.kron(fa1[label], fa2[label])
-
-    states = []
-    for state1 in fa1.states:
-        for state2 in fa2.states:
-            state_index = states_count2 * fa1.index_of(state1) + fa2.index_of(state2)
-
-            state = State((state1.value, state2.value))
-            states_indices[state] = state_index
-            states.append(state)
-            if state1 in fa1.start_states and state2 in fa2.start_states:
-                start_states.add(state)
-            if state1 in fa1.final_states and state2 in fa2.final_states:
-                final_states.add(state)
-
-    return BooleanDecomposition(
-        states_indices, intersected_label_matrices, states, start_states, final_states
-    )
+        intersected_label_matrices[label] = sparse.kron(
+            fa1[label], fa2[label], format="csr"
+        )
+
+    return ProductDecomposition(fa1, fa2, intersected_label_matrices)
 
 
 def intersect(fa1: FiniteAutomaton, fa2: FiniteAutomaton) -> FiniteAutomaton:
@@ -173,120 +373,454 @@ def intersect(fa1: FiniteAutomaton, fa2: FiniteAutomaton) -> FiniteAutomaton:
     return intersect_boolean(bdecomp1, bdecomp2).compose()
 
 
-def adjacency_matrix(fa: FiniteAutomaton):
-    states_count = len(fa.states)
-    if states_count == 0:
-        return sparse.dok_matrix((0, 0), dtype=bool)
-
-    states_indices = {state: ind for (ind, state) in enumerate(fa.states)}
-    adj_matrix = sparse.dok_matrix((states_count, states_count), dtype=bool)
-    for source, transitions_from_source in fa.to_dict().items():
-        for destinations in transitions_from_source.values():
-            if not isinstance(destinations, set):
-                destinations = {destinations}
-
-            for destination in destinations:
-                source_ind = states_indices[source]
-                destination_ind = states_indices[destination]
-                adj_matrix[source_ind, destination_ind] = True
-    return adj_matrix
-
-
-def _transitive_closure(adj_matrix):
-    prev = adj_matrix.nnz
-    curr = 0
+def disjoint_union_boolean(
+    decomps: List[BooleanDecomposition],
+) -> Tuple[BooleanDecomposition, np.ndarray]:
+    """
+    Disjoint union of the automata: the state s of the i-th one becomes the
+    state (i, s), and label matrices are block-diagonal. Also returns the
+    array mapping every state index of the union to its automaton number.
+    """
+    states = [
+        State((i, state.value))
+        for i, decomp in enumerate(decomps)
+        for state in decomp.states
+    ]
+    tags = np.repeat(
+        np.arange(len(decomps)), [decomp.states_count for decomp in decomps]
+    )
 
-    while prev != curr:
-        adj_matrix += adj_matrix @ adj_matrix
-        prev = curr
-        curr = adj_matrix.nnz
+    labels = set().union(*(decomp.labels for decomp in decomps))
+    label_matrices = {}
+    for label in labels:
+        label_matrices[label] = sparse.block_diag(
+            [
+                decomp[label]
+                if label in decomp.labels
+                else sparse.csr_matrix((decomp.states_count,) * 2, dtype=bool)
+                for decomp in decomps
+            ],
+            format="csr",
+            dtype=bool,
+        )
 
-    return adj_matrix
+    def tagged(decomp_states, i):
+        return {State((i, state.value)) for state in decomp_states}
 
+    union = BooleanDecomposition(
+        {state: ind for ind, state in enumerate(states)},
+        label_matrices,
+        states,
+        set().union(
+            *(tagged(decomp.start_states, i) for i, decomp in enumerate(decomps))
+        ),
+        set().union(
+            *(tagged(decomp.final_states, i) for i, decomp in enumerate(decomps))
+        ),
+    )
+    return union, tags
 
-def transitive_closure_boolean(decomp: "BooleanDecomposition"):
-    return _transitive_closure(decomp.adjacency_matrix)
 
+def adjacency_matrix(fa: FiniteAutomaton):
+    states_indices = {state: ind for (ind, state) in enumerate(fa.states)}
+    sources, destinations = [], []
+    for source, _, destination in fa:
+        sources.append(states_indices[source])
+        destinations.append(states_indices[destination])
+    return _bool_csr(sources, destinations, len(states_indices))
+
+
+def _transitive_closure(
+    adj_matrix,
+    on_iteration: Callable[[int, int, int], None] = None,
+    sources=None,
+    backend: str = None,
+) -> sparse.csr_matrix:
+    """
+    Semi-naive transitive closure: on every iteration only the pairs found on
+    the previous one are extended by a single edge, and pairs that are already
+    known are masked out of the result.
+
+    If sources are given, only their rows are propagated, which makes it a
+    multi-source BFS instead of the all-pairs closure.
+
+    on_iteration is called after every iteration with the iteration number,
+    the number of newly found pairs and the current size of the closure.
+
+    Matrices are kept in the named backend, chosen by the density of the
+    adjacency matrix if not given.
+    """
+    adj_matrix = sparse.csr_matrix(adj_matrix, dtype=bool)
+    matrices = mb.choose_backend(adj_matrix.shape, adj_matrix.nnz, backend)
+    closure = matrices.from_csr(
+        adj_matrix
+        if sources is None
+        else _select(sources, adj_matrix.shape[0]) @ adj_matrix
+    )
+    adj_matrix = matrices.from_csr(adj_matrix)
+    delta = closure
+
+    iteration = 0
+    while delta.nnz != 0:
+        delta = (delta @ adj_matrix) > closure
+        closure = closure + delta
+        iteration += 1
+        if on_iteration is not None:
+            on_iteration(iteration, delta.nnz, closure.nnz)
+
+    return matrices.to_csr(closure)
+
+
+def extend_transitive_closure(
+    closure, added
+) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+    """
+    Updates the transitive closure of a matrix after the added edges are put
+    into it. Between two added edges a new path runs over old edges only, so
+    new pairs are grown semi-naively by one added edge and an old path at a
+    time. Returns the new closure and the pairs missing from the old one.
+    """
+    closure = sparse.csr_matrix(closure, dtype=bool)
+    added = sparse.csr_matrix(added, dtype=bool)
+    reflexive = closure + sparse.eye(closure.shape[0], dtype=bool, format="csr")
+    step = added @ reflexive
+
+    delta = (reflexive @ step) > closure
+    new_pairs = delta
+    while delta.nnz != 0:
+        closure = closure + delta
+        delta = (delta @ step) > closure
+        new_pairs = new_pairs + delta
+
+    return closure, new_pairs
+
+
+def _select(indices, states_count: int) -> sparse.csr_matrix:
+    selection = np.zeros(states_count, dtype=bool)
+    selection[indices] = True
+    return mb.csr_diagonal(selection)
+
+
+def _restrict(matrix, sources=None, targets=None) -> sparse.csr_matrix:
+    states_count = matrix.shape[0]
+    if sources is not None:
+        matrix = _select(sources, states_count) @ matrix
+    if targets is not None:
+        matrix = matrix @ _select(targets, states_count)
+    return sparse.csr_matrix(matrix)
+
+
+def _topological_layers(dag: sparse.csr_matrix) -> List[np.ndarray]:
+    vertices_count = dag.shape[0]
+    indegree = np.bincount(dag.indices, minlength=vertices_count)
+    layers = []
+    layer = np.flatnonzero(indegree == 0)
+    while layer.size != 0:
+        layers.append(layer)
+        successors = dag[layer].indices
+        indegree -= np.bincount(successors, minlength=vertices_count)
+        successors = np.unique(successors)
+        layer = successors[indegree[successors] == 0]
+    return layers
+
+
+def _bits_to_mask(bits: int, size: int) -> np.ndarray:
+    packed = np.frombuffer(bits.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder="little")[:size].astype(bool)
+
+
+def _scc_transitive_closure(
+    adj_matrix, sources=None, targets=None, on_iteration=None, backend=None
+) -> sparse.csr_matrix:
+    """
+    Transitive closure over the condensation of the graph: reachability
+    between strongly connected components is computed once in reverse
+    topological order, components' successors being stored as bitsets, and
+    expanded back to states only for the requested sources and targets.
+    The bitsets are used whatever backend is requested.
+    """
+    adj_matrix = sparse.csr_matrix(adj_matrix, dtype=bool)
+    states_count = adj_matrix.shape[0]
+    if states_count == 0:
+        return adj_matrix
 
-def transitive_closure(fa: FiniteAutomaton):
-    return _transitive_closure(adjacency_matrix(fa))
+    components_count, components = csgraph.connected_components(
+        adj_matrix, directed=True, connection="strong"
+    )
+    membership = sparse.csr_matrix(
+        (
+            np.ones(states_count, dtype=bool),
+            (np.arange(states_count), components),
+        ),
+        shape=(states_count, components_count),
+    )
+    condensed = sparse.csr_matrix(membership.T @ adj_matrix @ membership)
+    cyclic = condensed.diagonal()
+    condensed.setdiag(False)
+    condensed.eliminate_zeros()
+
+    reachable = [0] * components_count
+    for layer in reversed(_topological_layers(condensed)):
+        for component in layer:
+            bits = 1 << int(component) if cyclic[component] else 0
+            successors = condensed.indices[
+                condensed.indptr[component] : condensed.indptr[component + 1]
+            ]
+            for successor in successors:
+                bits |= (1 << int(successor)) | reachable[successor]
+            reachable[component] = bits
+
+    sources = np.arange(states_count) if sources is None else np.asarray(sources)
+    targets = np.arange(states_count) if targets is None else np.asarray(targets)
+    targets_components = components[targets]
+
+    rows, cols = [], []
+    for component in np.unique(components[sources]):
+        reachable_mask = _bits_to_mask(reachable[component], components_count)
+        reached_targets = targets[reachable_mask[targets_components]]
+        if reached_targets.size == 0:
+            continue
+        component_sources = sources[components[sources] == component]
+        rows.append(np.repeat(component_sources, reached_targets.size))
+        cols.append(np.tile(reached_targets, component_sources.size))
+
+    if not rows:
+        return sparse.csr_matrix((states_count, states_count), dtype=bool)
+    return _bool_csr(np.concatenate(rows), np.concatenate(cols), states_count)
+
+
+def _semi_naive_transitive_closure(
+    adj_matrix, sources=None, targets=None, on_iteration=None, backend=None
+) -> sparse.csr_matrix:
+    closure = _transitive_closure(adj_matrix, on_iteration, sources, backend)
+    return _restrict(closure, targets=targets)
+
+
+_closure_methods = {
+    "semi_naive": _semi_naive_transitive_closure,
+    "scc": _scc_transitive_closure,
+}
+
+
+def transitive_closure_boolean(
+    decomp: "BooleanDecomposition",
+    on_iteration: Callable[[int, int, int], None] = None,
+    method: str = "semi_naive",
+    sources=None,
+    targets=None,
+    backend: str = None,
+):
+    """
+    Transitive closure of the adjacency matrix of decomp. If sources or
+    targets are given, only pairs from sources to targets (state indices)
+    are kept in the result.
+    """
+    closure = _closure_methods[method]
+    return closure(decomp.adjacency_matrix, sources, targets, on_iteration, backend)
 
 
-def _create_front(fa: FiniteAutomaton, constraint: FiniteAutomaton):
-    n = len(fa.states)
-    k = len(constraint.states)
+def transitive_closure(
+    fa: FiniteAutomaton,
+    on_iteration: Callable[[int, int, int], None] = None,
+    method: str = "semi_naive",
+    backend: str = None,
+):
+    closure = _closure_methods[method]
+    return closure(adjacency_matrix(fa), on_iteration=on_iteration, backend=backend)
 
-    front = sparse.lil_matrix((k, n + k))
 
-    tail = sparse.lil_array([[state in fa.start_states for state in fa.states]])
+def _create_front(
+    matrices,
+    graph_states_cnt: int,
+    constraint_states_cnt: int,
+    start_indices: np.ndarray,
+    separated_start: bool,
+):
+    """
+    Graph part of the initial front: row i * k + j (or j without
+    separated_start) holds the i-th start vertex (every start vertex) for
+    the j-th of the k constraint states.
+    """
+    if separated_start:
+        rows = np.arange(start_indices.size * constraint_states_cnt)
+        cols = np.repeat(start_indices, constraint_states_cnt)
+    else:
+        rows = np.repeat(np.arange(constraint_states_cnt), start_indices.size)
+        cols = np.tile(start_indices, constraint_states_cnt)
+
+    rows_count = (
+        start_indices.size * constraint_states_cnt
+        if separated_start
+        else constraint_states_cnt
+    )
+    return matrices.from_csr(
+        sparse.csr_matrix(
+            (np.ones(rows.size, dtype=bool), (rows, cols)),
+            shape=(rows_count, graph_states_cnt),
+        )
+    )
 
-    for i in range(k):
-        front[i, i] = True
-        front[i, k:] = tail
 
-    return front.tocsr()
+def _front_step(
+    matrices,
+    front,
+    constraint_mtx: sparse.csr_matrix,
+    graph_mtx,
+    separated_start: bool,
+):
+    """
+    Makes a step of the front by a single label. A nonempty row r of the
+    front is in the constraint state r % k, so the vertices it reaches by
+    the label are moved to the rows of the constraint states the label
+    leads to from there, which ORs the merged rows.
+    """
+    constraint_states_cnt = constraint_mtx.shape[0]
+    reached = matrices.nonempty_rows(front)
+    transitions = constraint_mtx[reached % constraint_states_cnt]
+    sources = np.repeat(reached, np.diff(transitions.indptr))
+    targets = (
+        sources // constraint_states_cnt * constraint_states_cnt + transitions.indices
+        if separated_start
+        else transitions.indices
+    )
+    if sources.size == 0:
+        return matrices.zeros(front.shape)
+    return matrices.move_rows(front @ graph_mtx, sources, targets, front.shape[0])
 
 
-def _transform_front(front, constraint_states_cnt: int, separated_start):
-    new_front = sparse.csr_matrix(front.shape, dtype=bool)
-    for row, col in zip(*front.nonzero()):
-        if col < constraint_states_cnt:
-            row_tail = front[row, constraint_states_cnt:]
-            if row_tail.nnz != 0:
-                shifted_row = (
-                    row // constraint_states_cnt * constraint_states_cnt + col
-                    if separated_start
-                    else col
-                )
-                new_front[shifted_row, col] = True
-                new_front[shifted_row, constraint_states_cnt:] += row_tail
-    return new_front
+def _front_backend(
+    decomp_fa: "BooleanDecomposition", front_rows: int, backend: str = None
+):
+    """
+    Backend of a front with front_rows rows over the states of decomp_fa and
+    of the label matrices it is multiplied by. It is chosen by the shape of
+    the front, assumed to be as dense as the label matrices, so a front with
+    many rows is never stored densely; the label matrices must fit too.
+    """
+    if backend is not None:
+        return mb.backends[backend]
+    states_count = decomp_fa.states_count
+    density = decomp_fa.nnz / max(1, states_count * states_count)
+    front_shape = (front_rows, states_count)
+    matrices = mb.choose_backend(front_shape, int(density * front_rows * states_count))
+    if matrices is mb.BitsetBackend and decomp_fa.backend is not mb.BitsetBackend:
+        return mb.SparseBackend
+    return matrices
 
 
 def constraint_reachability(
     fa: FiniteAutomaton,
     constraint: FiniteAutomaton,
     separated_start: bool = False,
+    workers: int = None,
+    backend: str = None,
 ):
-    decomp_fa = BooleanDecomposition.from_fa(fa)
-    decomp_constraint = BooleanDecomposition.from_fa(constraint)
-    constr_states_cnt = len(constraint.states)
-    labels = decomp_fa.labels & decomp_constraint.labels
+    return constraint_reachability_boolean(
+        BooleanDecomposition.from_fa(fa),
+        BooleanDecomposition.from_fa(constraint),
+        separated_start,
+        workers,
+        backend,
+    )
 
-    direct_sum = {}
-    for label in labels:
-        direct_sum[label] = sparse.block_diag(
-            (decomp_constraint[label], decomp_fa[label])
+
+def constraint_reachability_boolean(
+    decomp_fa: "BooleanDecomposition",
+    decomp_constraint: "BooleanDecomposition",
+    separated_start: bool = False,
+    workers: int = None,
+    backend: str = None,
+):
+    """
+    With workers set, the products of the front and every label matrix are
+    computed concurrently by that many threads. The front is kept in the
+    named backend, by default the one suiting the front's size.
+    """
+    if separated_start:
+        return constraint_reachability_pairs(
+            decomp_fa, decomp_constraint, workers, backend
+        ).to_set()
+
+    _, finals = _constraint_reachability(
+        decomp_fa, decomp_constraint, False, workers, backend
+    )
+    return {decomp_fa.state_at(final) for final in finals}
+
+
+def constraint_reachability_pairs(
+    decomp_fa: "BooleanDecomposition",
+    decomp_constraint: "BooleanDecomposition",
+    workers: int = None,
+    backend: str = None,
+) -> IndexPairs:
+    """
+    Same as constraint_reachability_boolean with separated_start, but the
+    (start, final) pairs of states are streamed rather than built as a set.
+    """
+    starts, finals = _constraint_reachability(
+        decomp_fa, decomp_constraint, True, workers, backend
+    )
+    return IndexPairs(starts, finals, decomp_fa.state_at)
+
+
+def _constraint_reachability(
+    decomp_fa: "BooleanDecomposition",
+    decomp_constraint: "BooleanDecomposition",
+    separated_start: bool,
+    workers: int = None,
+    backend: str = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices of the start states and of the final states reached from them
+    (the start indices are meaningless without separated_start).
+    """
+    constr_states_cnt = decomp_constraint.states_count
+    labels = list(decomp_fa.labels & decomp_constraint.labels)
+    start_indices = np.flatnonzero(decomp_fa.start_mask)
+    front_rows = (
+        start_indices.size * constr_states_cnt if separated_start else constr_states_cnt
+    )
+    matrices = _front_backend(decomp_fa, front_rows, backend)
+
+    graph_matrices = {label: matrices.from_csr(decomp_fa[label]) for label in labels}
+    constraint_matrices = {
+        label: sparse.csr_matrix(decomp_constraint[label], dtype=bool)
+        for label in labels
+    }
+
+    front = _create_front(
+        matrices,
+        decomp_fa.states_count,
+        constr_states_cnt,
+        start_indices,
+        separated_start,
+    )
+
+    def step(label):
+        return _front_step(
+            matrices,
+            front,
+            constraint_matrices[label],
+            graph_matrices[label],
+            separated_start,
         )
 
-    front = (
-        sparse.vstack([_create_front(fa, constraint) for _ in fa.start_states])
-        if separated_start
-        else _create_front(fa, constraint)
+    visited = front
+    with _label_pool(workers, len(labels)) as executor:
+        while front.nnz != 0:
+            front = matrices.union(_map_labels(step, labels, executor), visited.shape)
+            front = front > visited
+            visited = visited + front
+
+    rows, cols = visited.nonzero()
+    accepted = (
+        decomp_constraint.final_mask[rows % constr_states_cnt]
+        & decomp_fa.final_mask[cols]
     )
+    rows, cols = rows[accepted], cols[accepted]
 
-    front_nnz = -1
-    while front_nnz != front.nnz:
-        front_nnz = front.nnz
-
-        for mtx in direct_sum.values():
-            step = front @ mtx
-            front += _transform_front(step, constr_states_cnt, separated_start)
-
-    result = set()
-    constraint_states = list(constraint.states)
-    fa_states = list(fa.states)
-
-    for row, col in zip(*front.nonzero()):
-        if (
-            not col < constr_states_cnt
-            and constraint_states[row % constr_states_cnt] in constraint.final_states
-        ):
-            state_index = col - constr_states_cnt
-            if fa_states[state_index] in fa.final_states:
-                if separated_start:
-                    result.add((State(row // constr_states_cnt), State(state_index)))
-                else:
-                    result.add(State(state_index))
-
-    return result
+    # a vertex may be reached in several final constraint states
+    pairs = np.unique(
+        np.stack([start_indices[rows // constr_states_cnt], cols], axis=1), axis=0
+    )
+    return pairs[:, 0], pairs[:, 1]
@@ -0,0 +1,123 @@
+import hashlib
+import io
+import os
+import pickle
+from collections import OrderedDict
+from dataclasses import dataclass
+from pyformlang.cfg import CFG
+from pyformlang.cfg.cfg_object import CFGObject
+from pyformlang.finite_automaton.finite_automaton_object import FiniteAutomatonObject
+from threading import Lock
+from typing import Any, Callable
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    size: int
+
+
+class _Pickler(pickle.Pickler):
+    # pyformlang objects cache their hashes, and str hashes differ between
+    # processes, so they are pickled as constructor calls to be hashed anew
+    def reducer_override(self, obj):
+        if isinstance(obj, (CFGObject, FiniteAutomatonObject)):
+            if type(obj).__name__ == "Epsilon":
+                return type(obj), ()
+            return type(obj), (obj.value,)
+        return NotImplemented
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Pickles the value so that pyformlang objects in it can be loaded by a
+    process with a different string hash seed.
+    """
+    buffer = io.BytesIO()
+    _Pickler(buffer).dump(value)
+    return buffer.getvalue()
+
+
+class LruCache:
+    """
+    Thread-safe LRU cache holding at most max_size values. If path is given,
+    computed values are also pickled into that directory and looked up there
+    on a miss before being computed again.
+    """
+
+    def __init__(self, max_size: int = 128, path: str = None):
+        self.__max_size = max_size
+        self.__path = path
+        self.__values = OrderedDict()
+        self.__lock = Lock()
+        self.__hits = 0
+        self.__misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    @property
+    def stats(self) -> CacheStats:
+        with self.__lock:
+            return CacheStats(self.__hits, self.__misses, len(self.__values))
+
+    def get(self, key: str, compute: Callable[[], Any]) -> Any:
+        with self.__lock:
+            if key in self.__values:
+                self.__hits += 1
+                self.__values.move_to_end(key)
+                return self.__values[key]
+            self.__misses += 1
+
+        value = self.__load(key)
+        if value is None:
+            value = compute()
+            self.__store(key, value)
+
+        with self.__lock:
+            self.__values[key] = value
+            self.__values.move_to_end(key)
+            while len(self.__values) > self.__max_size:
+                self.__values.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__values.clear()
+            self.__hits = 0
+            self.__misses = 0
+
+    def __file(self, key: str) -> str:
+        return os.path.join(self.__path, f"{key}.pickle")
+
+    def __load(self, key: str) -> Any:
+        if self.__path is None or not os.path.exists(self.__file(key)):
+            return None
+        with open(self.__file(key), "rb") as f:
+            return pickle.load(f)
+
+    def __store(self, key: str, value: Any) -> None:
+        if self.__path is None:
+            return
+        # written under a temporary name first, so readers never see a partial file
+        temporary = f"{self.__file(key)}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(dumps(value))
+        os.replace(temporary, self.__file(key))
+
+
+def cfg_fingerprint(cfg: CFG) -> str:
+    """
+    Hash of the grammar's start symbol and productions that does not depend
+    on the order the productions are stored in.
+    """
+
+    def symbol(obj) -> str:
+        return f"{type(obj).__name__}:{obj.value}"
+
+    productions = sorted(
+        " ".join([symbol(production.head), "->"] + [symbol(s) for s in production.body])
+        for production in cfg.productions
+    )
+    text = "\n".join([symbol(cfg.start_symbol)] + productions)
+    return hashlib.sha256(text.encode()).hexdigest()
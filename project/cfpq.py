@@ -1,14 +1,25 @@
 from networkx import MultiDiGraph
 from pyformlang.cfg import CFG, Variable, Production
+from collections import defaultdict
 from queue import SimpleQueue
-from typing import Set, Tuple, Any
+from typing import Set, Tuple, Any, Union, Dict, Iterable
 from dataclasses import dataclass
-from scipy.sparse import dok_array, eye, lil_matrix
+from functools import partial
+from scipy.sparse import csr_matrix, eye
+from pyformlang.finite_automaton import Symbol
+import numpy as np
+import os
 
 import project.cfg_utils as cfg_utils
+from project.cache import LruCache, cfg_fingerprint
 from project.ecfg import Ecfg
 from project.rsm import Rsm
 import project.automata_utils as au
+import project.matrix_backend as mb
+from project.compiled_graph import CompiledGraph, compile_graph
+from project.gll import gll
+from project.index_pairs import IndexPairs
+from project.sharding import run_sharded
 
 
 @dataclass
@@ -36,195 +47,550 @@ class Productions:
                 self.epsilon.add(production)
 
 
-def _hellings_cfpq(cfg: CFG, graph: MultiDiGraph) -> Set[Tuple[Any, Variable, Any]]:
-    prods = Productions(cfg)
+# grammars are also persisted on disk if GRAMMAR_CACHE_DIR is set
+grammar_cache = LruCache(path=os.environ.get("GRAMMAR_CACHE_DIR"))
 
-    paths = set()
 
-    for node in graph.nodes:
-        for prod in prods.epsilon:
-            paths.add((node, prod.head, node))
+def set_grammar_cache_path(path: str = None) -> None:
+    """
+    Makes grammar preprocessing results be persisted into the directory path
+    (or kept in memory only if path is None). The cache starts out empty.
+    """
+    global grammar_cache
+    grammar_cache = LruCache(path=path)
+
+
+def _productions(cfg: CFG) -> Productions:
+    return grammar_cache.get(f"wcnf-{cfg_fingerprint(cfg)}", lambda: Productions(cfg))
+
+
+def _rsm(cfg: CFG) -> Rsm:
+    return grammar_cache.get(
+        f"rsm-{cfg_fingerprint(cfg)}",
+        lambda: Rsm.from_ecfg(Ecfg.from_cfg(cfg)).minimize(),
+    )
+
+
+def _rsm_decomposition(cfg: CFG) -> au.BooleanDecomposition:
+    return grammar_cache.get(
+        f"rsm_decomposition-{cfg_fingerprint(cfg)}",
+        lambda: au.BooleanDecomposition.from_fa(_rsm(cfg).merge_boxes()),
+    )
+
 
-    for from_v, to_v, label in graph.edges.data("label"):
-        for prod in prods.terminal:
-            if label == prod.body[0].value:
-                paths.add((from_v, prod.head, to_v))
+def _triples(
+    graph: CompiledGraph, reachability: Dict[Variable, csr_matrix]
+) -> Set[Tuple[Any, Variable, Any]]:
+    """(u, N, v) node triples of the nonterminal matrices of an algorithm."""
+    return {
+        (graph.node_at(graph_from), nonterm, graph.node_at(graph_to))
+        for nonterm, matrix in reachability.items()
+        for graph_from, graph_to in zip(*mb.csr_nonzero(matrix))
+    }
+
+
+def _from_triples(
+    triples: Iterable[Tuple[int, Variable, int]], n: int
+) -> Dict[Variable, csr_matrix]:
+    coords = defaultdict(lambda: ([], []))
+    for graph_from, nonterm, graph_to in triples:
+        rows, cols = coords[nonterm]
+        rows.append(graph_from)
+        cols.append(graph_to)
+    return {
+        nonterm: mb.csr_from_coords(rows, cols, (n, n))
+        for nonterm, (rows, cols) in coords.items()
+    }
 
+
+def _hellings_cfpq(cfg: CFG, graph: CompiledGraph) -> Dict[Variable, csr_matrix]:
+    prods = _productions(cfg)
+
+    terminal_heads = defaultdict(set)
+    for prod in prods.terminal:
+        terminal_heads[prod.body[0].value].add(prod.head)
+
+    # B -> [(C, A)] and C -> [(B, A)] for every production A -> B C
+    by_left = defaultdict(list)
+    by_right = defaultdict(list)
+    for prod in prods.variable:
+        left, right = prod.body
+        by_left[left].append((right, prod.head))
+        by_right[right].append((left, prod.head))
+
+    paths = set()
+    # v -> var -> {u} for paths (v, var, u) and u -> var -> {v} respectively
+    paths_from = defaultdict(lambda: defaultdict(set))
+    paths_to = defaultdict(lambda: defaultdict(set))
     queue = SimpleQueue()
-    for r in paths:
-        queue.put(r)
-
-    def combine_paths(path1, path2, new_paths):
-        from_v1, var1, to_v1 = path1
-        from_v2, var2, to_v2 = path2
-        if to_v1 == from_v2:
-            for prod in prods.variable:
-                new_reachability = (from_v1, prod.head, to_v2)
-                if (
-                    prod.body[0] == var1
-                    and prod.body[1] == var2
-                    and new_reachability not in paths
-                ):
-                    queue.put(new_reachability)
-                    new_paths.add(new_reachability)
+
+    def add_path(from_v, var, to_v):
+        path = (from_v, var, to_v)
+        if path not in paths:
+            paths.add(path)
+            paths_from[from_v][var].add(to_v)
+            paths_to[to_v][var].add(from_v)
+            queue.put(path)
+
+    for node in range(graph.number_of_nodes):
+        for prod in prods.epsilon:
+            add_path(node, prod.head, node)
+
+    for label in graph.labels:
+        for from_v, to_v in zip(*mb.csr_nonzero(graph[label])):
+            for head in terminal_heads.get(label.value, ()):
+                add_path(int(from_v), head, int(to_v))
 
     while not queue.empty():
-        new_paths = set()
-        path1 = queue.get()
-        for path2 in paths:
-            combine_paths(path1, path2, new_paths)
-            combine_paths(path2, path1, new_paths)
-        paths |= new_paths
+        from_v, var, to_v = queue.get()
+
+        for right, head in by_left.get(var, ()):
+            for next_v in list(paths_from[to_v].get(right, ())):
+                add_path(from_v, head, next_v)
+
+        for left, head in by_right.get(var, ()):
+            for prev_v in list(paths_to[from_v].get(left, ())):
+                add_path(prev_v, head, to_v)
 
-    return paths
+    return _from_triples(paths, graph.number_of_nodes)
 
 
-def _matrix_cfpq(cfg: CFG, graph: MultiDiGraph) -> Set[Tuple[Any, Variable, Any]]:
-    prods = Productions(cfg)
+def _matrix_cfpq(
+    cfg: CFG, graph: CompiledGraph, backend: str = None
+) -> Dict[Variable, csr_matrix]:
+    """
+    Matrices are kept in the named backend, chosen by the density of the
+    graph if not given.
+    """
+    prods = _productions(cfg)
 
     var_to_mtx = {}
-    nodes = list(graph.nodes)
-    node_index = dict([(node, i) for i, node in enumerate(nodes)])
 
-    n = graph.number_of_nodes()
+    n = graph.number_of_nodes
+    matrices = mb.choose_backend(
+        (n, n), sum(graph[label].nnz for label in graph.labels), backend
+    )
     for var in prods.wcnf.variables:
-        var_to_mtx[var] = lil_matrix((n, n), dtype=bool)
+        var_to_mtx[var] = matrices.zeros((n, n))
 
-    for i, node in enumerate(graph.nodes):
-        for prod in prods.epsilon:
-            var_to_mtx[prod.head][i, i] = True
+    for prod in prods.epsilon:
+        var_to_mtx[prod.head] = var_to_mtx[prod.head] + matrices.eye(n)
 
-    for from_, to, label in graph.edges(data="label"):
-        for prod in prods.terminal:
-            if label == prod.body[0].value:
-                from_index = node_index[from_]
-                to_index = node_index[to]
-                var_to_mtx[prod.head][from_index, to_index] = True
+    for prod in prods.terminal:
+        label = prod.body[0].value
+        if label in graph.labels:
+            var_to_mtx[prod.head] = var_to_mtx[prod.head] + matrices.from_csr(
+                graph[label]
+            )
 
-    while True:
-        new_paths_found = False
+    # semi-naive evaluation: on every pass only the pairs found on the previous
+    # one are joined, via dB @ C + B @ dC for a production A -> B C
+    var_to_delta = {var: mtx for var, mtx in var_to_mtx.items() if mtx.nnz != 0}
+    while var_to_delta:
+        new_paths = {}
         for prod in prods.variable:
-            previous_nonzero_count = var_to_mtx[prod.head].count_nonzero()
-            assert isinstance(prod.body[0], Variable)
-            assert isinstance(prod.body[1], Variable)
-            var_to_mtx[prod.head] += var_to_mtx[prod.body[0]] @ var_to_mtx[prod.body[1]]
+            left, right = prod.body
+            if left not in var_to_delta and right not in var_to_delta:
+                continue
+
+            paths = matrices.zeros((n, n))
+            if left in var_to_delta:
+                paths = paths + var_to_delta[left] @ var_to_mtx[right]
+            if right in var_to_delta:
+                paths = paths + var_to_mtx[left] @ var_to_delta[right]
+            new_paths[prod.head] = (
+                new_paths[prod.head] + paths if prod.head in new_paths else paths
+            )
 
-            new_paths_found |= (
-                previous_nonzero_count != var_to_mtx[prod.head].count_nonzero()
+        var_to_delta = {}
+        for var, paths in new_paths.items():
+            delta = paths > var_to_mtx[var]
+            if delta.nnz != 0:
+                var_to_delta[var] = delta
+                var_to_mtx[var] = var_to_mtx[var] + delta
+
+    return {var: matrices.to_csr(matrix) for var, matrix in var_to_mtx.items()}
+
+
+def _tensor_cfpq(cfg: CFG, graph: CompiledGraph) -> Dict[Variable, csr_matrix]:
+    bmatrix_rsm = _rsm_decomposition(cfg)
+    bmatrix_graph = graph.decomposition()
+    graph_states_count = bmatrix_graph.states_count
+    product_states_count = bmatrix_rsm.states_count * graph_states_count
+
+    boxes = [state.value[0] for state in bmatrix_rsm.states]
+    nonterms = list(dict.fromkeys(boxes))
+    box_codes = np.array([nonterms.index(box) for box in boxes], dtype=np.int64)
+
+    def found_edges(pairs) -> Dict[Variable, Tuple[np.ndarray, np.ndarray]]:
+        rows, cols = mb.csr_nonzero(pairs)
+        rsm_from, graph_from = np.divmod(rows, graph_states_count)
+        rsm_to, graph_to = np.divmod(cols, graph_states_count)
+        accepted = bmatrix_rsm.start_mask[rsm_from] & bmatrix_rsm.final_mask[rsm_to]
+        codes = box_codes[rsm_from[accepted]]
+        graph_from, graph_to = graph_from[accepted], graph_to[accepted]
+
+        return {
+            Variable(nonterms[code].value): (
+                graph_from[codes == code],
+                graph_to[codes == code],
             )
+            for code in np.unique(codes)
+        }
+
+    def kron_keys(label: Symbol, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        csr_from_keys keys of the Kronecker product of the RSM matrix of label
+        and the matrix with the given edges.
+        """
+        rsm_rows, rsm_cols = rsm_coords[label]
+        kron_rows = np.add.outer(rsm_rows * graph_states_count, rows).ravel()
+        kron_cols = np.add.outer(rsm_cols * graph_states_count, cols).ravel()
+        return kron_rows * product_states_count + kron_cols
+
+    def add_edges(edges: Dict[Variable, csr_matrix]) -> None:
+        for nonterm, matrix in edges.items():
+            label = Symbol(nonterm.value)
+            if label in bmatrix_graph.labels:
+                bmatrix_graph[label] = bmatrix_graph[label] + matrix
+            else:
+                bmatrix_graph[label] = matrix
+
+    identity_matrix = eye(graph_states_count, format="csr", dtype=bool)
+    nonterm_edges = {
+        Variable(nonterm.value): identity_matrix
+        for nonterm in cfg.get_nullable_symbols()
+    }
+    add_edges(nonterm_edges)
+
+    # the closure is built once and then only extended with the Kronecker
+    # product of the nonterminal edges found on the previous iteration
+    closure = au.transitive_closure_boolean(
+        au.intersect_boolean(bmatrix_rsm, bmatrix_graph)
+    )
+    # coordinates of the RSM matrices are taken once, so that the Kronecker
+    # products of new edges are built directly as CSR on every step
+    rsm_coords = {
+        label: mb.csr_nonzero(bmatrix_rsm[label]) for label in bmatrix_rsm.labels
+    }
+    new_pairs = closure
+    while True:
+        new_edges = {}
+        added_keys = []
+        for nonterm, (rows, cols) in found_edges(new_pairs).items():
+            if nonterm in nonterm_edges and rows.size != 0:
+                known = np.asarray(nonterm_edges[nonterm][rows, cols]).ravel()
+                rows, cols = rows[~known], cols[~known]
+            if rows.size == 0:
+                continue
+            new_edges[nonterm] = mb.csr_from_keys(
+                rows * graph_states_count + cols,
+                (graph_states_count, graph_states_count),
+            )
+            label = Symbol(nonterm.value)
+            if label in rsm_coords:
+                added_keys.append(kron_keys(label, rows, cols))
 
-        if not new_paths_found:
+        if not new_edges:
             break
 
-    reachabilities = set()
-    for variable, matrix in var_to_mtx.items():
-        rows, cols = matrix.nonzero()
-        for i in range(len(rows)):
-            row_index = rows[i]
-            col_index = cols[i]
-            reachabilities.add((nodes[row_index], variable, nodes[col_index]))
+        for nonterm, edges in new_edges.items():
+            nonterm_edges[nonterm] = (
+                nonterm_edges[nonterm] + edges if nonterm in nonterm_edges else edges
+            )
+        add_edges(new_edges)
 
-    return reachabilities
+        if not added_keys:
+            break
+        added = mb.csr_from_keys(np.concatenate(added_keys), closure.shape)
+        closure, new_pairs = au.extend_transitive_closure(closure, added)
 
+    return nonterm_edges
 
-def _tensor_cfpq(cfg: CFG, graph: MultiDiGraph) -> Set[Tuple[Any, Variable, Any]]:
-    bmatrix_rsm = au.BooleanDecomposition.from_fa(
-        Rsm.from_ecfg(Ecfg.from_cfg(cfg)).minimize().merge_boxes()
-    )
 
-    bmatrix_graph = au.BooleanDecomposition.from_fa(au.nfa_from_graph(graph))
-    graph_states_count = len(bmatrix_graph.states)
-
-    identity_matrix = eye(graph_states_count, format="dok", dtype=bool)
-    for nonterm in cfg.get_nullable_symbols():
-        if nonterm.value in bmatrix_graph.labels:
-            bmatrix_graph[nonterm.value] += identity_matrix
-        else:
-            bmatrix_graph[nonterm.value] = identity_matrix
-
-    new_paths_found = True
-    last_iteration_nnz = 0
-    while new_paths_found:
-        tc_indexes = list(
-            zip(
-                *au.transitive_closure_boolean(
-                    au.intersect_boolean(bmatrix_rsm, bmatrix_graph)
-                ).nonzero()
-            )
-        )
-        new_paths_found &= last_iteration_nnz != len(tc_indexes)
-        last_iteration_nnz = len(tc_indexes)
-
-        for i_from, i_to in tc_indexes:
-            rsm_from, graph_from = divmod(i_from, graph_states_count)
-            rsm_to, graph_to = divmod(i_to, graph_states_count)
-
-            state_from = bmatrix_rsm.states[rsm_from]
-            state_to = bmatrix_rsm.states[rsm_to]
-            nonterm, _ = state_from.value
-            if (
-                state_from in bmatrix_rsm.start_states
-                and state_to in bmatrix_rsm.final_states
-            ):
-                if nonterm.value in bmatrix_graph.labels:
-                    bmatrix_graph[nonterm.value][graph_from, graph_to] = True
-                else:
-                    bmatrix_graph[nonterm.value] = lil_matrix(
-                        (
-                            graph_states_count,
-                            graph_states_count,
-                        ),
-                        dtype=bool,
-                    )
-                    bmatrix_graph[nonterm.value][graph_from, graph_to] = True
-    return {
-        (
-            bmatrix_graph.states[graph_from],
-            nonterm,
-            bmatrix_graph.states[graph_to],
+def _gll_cfpq(cfg: CFG, graph: CompiledGraph) -> Dict[Variable, csr_matrix]:
+    rsm = _rsm(cfg)
+    calls = (
+        (nonterm, vertex)
+        for nonterm in rsm.boxes
+        for vertex in range(graph.number_of_nodes)
+    )
+    return _from_triples(gll(rsm, graph, calls), graph.number_of_nodes)
+
+
+def _rows(matrix: csr_matrix, rows: np.ndarray) -> csr_matrix:
+    """
+    Matrix of the shape of matrix holding only its rows at the sorted indices
+    rows, which are sliced out of it rather than selected by a product.
+    """
+    taken = matrix[rows]
+    indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+    indptr[rows + 1] = np.diff(taken.indptr)
+    np.cumsum(indptr, out=indptr)
+    return csr_matrix((taken.data, taken.indices, indptr), shape=matrix.shape)
+
+
+def _reachable(graph: CompiledGraph, start_rows: np.ndarray) -> np.ndarray:
+    """Sorted indices of the nodes reachable from the given ones by any path."""
+    reached = np.zeros(graph.number_of_nodes, dtype=bool)
+    reached[start_rows] = True
+    front = start_rows
+    while front.size != 0:
+        found = np.concatenate(
+            [front[:0]] + [graph[label][front].indices for label in graph.labels]
         )
-        for nonterm, matrix in bmatrix_graph.items
-        for graph_from, graph_to in zip(*matrix.nonzero())
-    }
+        found = np.sort(found[~reached[found]])
+        front = found[np.diff(found, prepend=-1) != 0]
+        reached[front] = True
+    return np.flatnonzero(reached)
+
+
+def _multi_source_matrix_cfpq(
+    cfg: CFG, graph: CompiledGraph, start_rows: np.ndarray, start_symbol: Variable
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (start, final) index pairs computed by matrix CFPQ over the part of the
+    graph reachable from the start nodes, which computes the rows of a
+    nonterminal matrix only for the vertices it is actually derived from:
+    rows of S for the start vertices, rows of B and C for a production
+    A -> B C for the rows of A and for the vertices B leads to from them
+    respectively.
+
+    As in _matrix_cfpq, evaluation is semi-naive: for a production A -> B C
+    every pass only joins the rows found on the previous one, via
+    B[new A rows] @ C + dB[old A rows] @ C + B[old A rows] @ dC.
+    """
+    prods = _productions(cfg)
+    if start_symbol not in prods.wcnf.variables:
+        return start_rows[:0], start_rows[:0]
+
+    nodes = _reachable(graph, start_rows)
+    n = nodes.size
+    empty = csr_matrix((n, n), dtype=bool)
+
+    nullable = {prod.head for prod in prods.epsilon}
+    var_to_labels = defaultdict(list)
+    for prod in prods.terminal:
+        label = prod.body[0].value
+        if label in graph.labels:
+            var_to_labels[prod.head].append(graph[label][nodes][:, nodes])
+
+    by_head = defaultdict(list)
+    by_body = defaultdict(list)
+    for prod in prods.variable:
+        left, right = prod.body
+        by_head[prod.head].append(prod)
+        by_body[left].append(prod)
+        by_body[right].append(prod)
+
+    var_to_mtx = defaultdict(lambda: empty)
+    var_to_sources = defaultdict(lambda: np.zeros(n, dtype=bool))
+
+    def update(found_sources, found_paths):
+        """Adds the found sources and paths, returning the new ones."""
+        new_sources = {}
+        for var, rows in found_sources.items():
+            new = np.zeros(n, dtype=bool)
+            new[np.concatenate(rows)] = True
+            new &= ~var_to_sources[var]
+            if not new.any():
+                continue
+            var_to_sources[var] = var_to_sources[var] | new
+            new_sources[var] = new
+            # rows of the new sources start out as the rows of the base matrix
+            new_rows = np.flatnonzero(new)
+            found_paths[var].extend(_rows(mtx, new_rows) for mtx in var_to_labels[var])
+            if var in nullable:
+                found_paths[var].append(mb.csr_diagonal(new))
+
+        deltas = {}
+        for var, paths in found_paths.items():
+            delta = mb.SparseBackend.union(paths, (n, n)) > var_to_mtx[var]
+            if delta.nnz != 0:
+                deltas[var] = delta
+                var_to_mtx[var] = var_to_mtx[var] + delta
+        return new_sources, deltas
+
+    start_rows = np.searchsorted(nodes, start_rows)
+    new_sources, deltas = update({start_symbol: [start_rows]}, defaultdict(list))
+    while new_sources or deltas:
+        active = {prod for var in new_sources for prod in by_head[var]}
+        active.update(prod for var in deltas for prod in by_body[var])
+
+        found_sources = defaultdict(list)
+        found_paths = defaultdict(list)
+        for prod in active:
+            head = prod.head
+            left, right = prod.body
+            if head not in var_to_sources:
+                continue
+            new = new_sources.get(head, np.zeros(n, dtype=bool))
+            old = var_to_sources[head] & ~new
+
+            steps = []
+            if new.any():
+                new_rows = np.flatnonzero(new)
+                found_sources[left].append(new_rows)
+                steps.append((_rows(var_to_mtx[left], new_rows), var_to_mtx[right]))
+            if left in deltas:
+                steps.append(
+                    (_rows(deltas[left], np.flatnonzero(old)), var_to_mtx[right])
+                )
+            for paths, right_mtx in steps:
+                # vertices B leads to from the rows of A are sources of C
+                found_sources[right].append(paths.indices)
+                found_paths[head].append(paths @ right_mtx)
+            if right in deltas:
+                paths = _rows(var_to_mtx[left], np.flatnonzero(old))
+                found_paths[head].append(paths @ deltas[right])
+
+        new_sources, deltas = update(found_sources, found_paths)
+
+    starts, finals = mb.csr_nonzero(_rows(var_to_mtx[start_symbol], start_rows))
+    return nodes[starts], nodes[finals]
+
+
+def _nodes_mask(graph: CompiledGraph, nodes: Set[Any]) -> np.ndarray:
+    mask = np.zeros(graph.number_of_nodes, dtype=bool)
+    mask[[graph.index_of(node) for node in nodes if node in graph]] = True
+    return mask
+
+
+def _cfpq_pairs(
+    cfg: CFG,
+    graph: CompiledGraph,
+    algo,
+    start_nodes: Set[Any] = None,
+    final_nodes: Set[Any] = None,
+    start_symbol: Variable = Variable("S"),
+) -> IndexPairs:
+    n = graph.number_of_nodes
+    paths = algo(cfg, graph).get(start_symbol, csr_matrix((n, n), dtype=bool))
+    if start_nodes:
+        paths = _rows(paths, np.flatnonzero(_nodes_mask(graph, start_nodes)))
+    if final_nodes:
+        paths = paths @ mb.csr_diagonal(_nodes_mask(graph, final_nodes))
+
+    starts, finals = mb.csr_nonzero(paths)
+    return IndexPairs(starts, finals, graph.node_at)
 
 
 def _cfpq(
     cfg: CFG,
-    graph: MultiDiGraph,
+    graph: CompiledGraph,
     algo,
     start_nodes: Set[Any] = None,
     final_nodes: Set[Any] = None,
     start_symbol: Variable = Variable("S"),
 ) -> Set[Tuple[Any, Any]]:
-    if not start_nodes:
-        start_nodes = set(graph.nodes)
-    if not final_nodes:
-        final_nodes = set(graph.nodes)
-
-    paths = algo(cfg, graph)
-
-    result_paths = set()
-    for v1, var, v2 in paths:
-        if var == start_symbol and v1 in start_nodes and v2 in final_nodes:
-            result_paths.add((v1, v2))
-
-    return result_paths
+    return _cfpq_pairs(
+        cfg, graph, algo, start_nodes, final_nodes, start_symbol
+    ).to_set()
 
 
 _algos = {
     "hellings": _hellings_cfpq,
     "matrix": _matrix_cfpq,
     "tensor": _tensor_cfpq,
+    "gll": _gll_cfpq,
 }
 
 
 def cfpq(
     cfg: CFG,
-    graph: MultiDiGraph,
+    graph: Union[MultiDiGraph, CompiledGraph],
     algorithm: str,
     start_nodes: Set[Any] = None,
     final_nodes: Set[Any] = None,
     start_symbol: Variable = Variable("S"),
 ) -> Set[Tuple[Any, Any]]:
     algo = _algos[algorithm]
-    return _cfpq(cfg, graph, algo, start_nodes, final_nodes, start_symbol)
+    return _cfpq(
+        cfg, compile_graph(graph), algo, start_nodes, final_nodes, start_symbol
+    )
+
+
+def cfpq_pairs(
+    cfg: CFG,
+    graph: Union[MultiDiGraph, CompiledGraph],
+    algorithm: str,
+    start_nodes: Set[Any] = None,
+    final_nodes: Set[Any] = None,
+    start_symbol: Variable = Variable("S"),
+) -> IndexPairs:
+    """Same as cfpq, but the answer is streamed rather than built as a set."""
+    algo = _algos[algorithm]
+    return _cfpq_pairs(
+        cfg, compile_graph(graph), algo, start_nodes, final_nodes, start_symbol
+    )
+
+
+_multi_source_algos = {"matrix", "gll"}
+
+
+def multi_source_cfpq(
+    cfg: CFG,
+    graph: Union[MultiDiGraph, CompiledGraph],
+    start_nodes: Set[Any] = None,
+    final_nodes: Set[Any] = None,
+    start_symbol: Variable = Variable("S"),
+    separated_start: bool = False,
+    algorithm: str = "gll",
+    processes: int = None,
+    shard_size: int = None,
+):
+    """
+    CFPQ from the given start nodes whose work scales with the part of the
+    graph reachable from them, computed either by GLL started at the start
+    nodes only ("gll") or by the row-restricted matrix algorithm ("matrix").
+    The matrix one needs a pass per step of the derivations it follows, so
+    it is usually slower than GLL. Start and final nodes are all nodes if
+    not given. Returns (start, final) pairs of node values if separated_start
+    is set and the set of reachable final node values otherwise; unlike
+    bfs_rpq, nodes are not wrapped into states.
+
+    With processes set, start nodes are split into shards of shard_size
+    nodes evaluated by that many processes.
+    """
+    if algorithm not in _multi_source_algos:
+        raise ValueError(f"Unknown multi-source CFPQ algorithm {algorithm}")
+    graph = compile_graph(graph)
+    if start_nodes is None:
+        start_nodes = set(graph.nodes)
+
+    if processes is not None:
+        query = partial(
+            multi_source_cfpq,
+            cfg,
+            final_nodes=final_nodes,
+            start_symbol=start_symbol,
+            separated_start=separated_start,
+            algorithm=algorithm,
+        )
+        return run_sharded(query, graph, start_nodes, processes, shard_size)
+
+    if final_nodes is None:
+        final_nodes = set(graph.nodes)
+
+    start_indices = [graph.index_of(node) for node in start_nodes if node in graph]
+
+    if algorithm == "gll":
+        rsm = _rsm(cfg)
+        calls = {(start_symbol, start) for start in start_indices}
+        pairs = [
+            (start, end)
+            for start, nonterm, end in gll(rsm, graph, calls)
+            if (nonterm, start) in calls
+        ]
+    else:
+        start_rows = np.unique(np.array(start_indices, dtype=np.int64))
+        pairs = zip(*_multi_source_matrix_cfpq(cfg, graph, start_rows, start_symbol))
+
+    result = {
+        (graph.node_at(start), graph.node_at(end))
+        for start, end in pairs
+        if graph.node_at(end) in final_nodes
+    }
+    if separated_start:
+        return result
+    return {final for _, final in result}
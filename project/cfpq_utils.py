@@ -1,9 +1,12 @@
 import cfpq_data
+import os
 from dataclasses import dataclass
 from typing import Iterable, Any, Tuple
 
 import networkx.drawing.nx_agraph
 
+from project.compiled_graph import CompiledGraph
+
 
 @dataclass
 class GraphInfo:
@@ -21,6 +24,14 @@ def get_graph_info(name: str) -> GraphInfo:
     )
 
 
+def get_compiled_graph(name: str, cache_dir: str) -> CompiledGraph:
+    path = os.path.join(cache_dir, name)
+    if not os.path.exists(os.path.join(path, "graph.json")):
+        graph = cfpq_data.graph_from_csv(cfpq_data.download(name))
+        CompiledGraph.from_graph(graph).save(path)
+    return CompiledGraph.load(path)
+
+
 def save_dot_labeled_two_cycles_graph(
     n: int, m: int, labels: Tuple[str, str], path: str
 ) -> None:
@@ -0,0 +1,200 @@
+from networkx import MultiDiGraph
+from pyformlang.finite_automaton import State, Symbol
+from scipy import sparse
+from typing import Any, Dict, Iterable, Iterator, KeysView, List, Set, Tuple, Union
+import json
+import os
+import numpy as np
+
+import project.automata_utils as au
+
+
+class CompiledGraph:
+    """
+    Edge-labeled graph compiled once into node indices and per-label boolean
+    CSR matrices, so that it can be shared by any number of queries.
+
+    Parallel edges with the same label collapse into one matrix entry, and
+    node indices are stable: nodes are only ever appended.
+    """
+
+    def __init__(self, nodes: Iterable[Any] = ()):
+        self.__states: List[State] = []
+        self.__states_indices: Dict[State, int] = {}
+        self.__label_matrices: Dict[Symbol, sparse.csr_matrix] = {}
+        self.add_nodes(nodes)
+
+    @staticmethod
+    def from_graph(graph: MultiDiGraph) -> "CompiledGraph":
+        compiled = CompiledGraph(graph.nodes)
+        compiled.add_edges(graph.edges(data="label"))
+        return compiled
+
+    def save(self, path: str) -> None:
+        """
+        Saves the graph into the directory path: node and label tables go to
+        graph.json, CSR arrays of the i-th label go to i.data.npy,
+        i.indices.npy and i.indptr.npy. Nodes and labels must be JSON
+        serializable.
+        """
+        os.makedirs(path, exist_ok=True)
+        labels = list(self.__label_matrices)
+        with open(os.path.join(path, "graph.json"), "w") as f:
+            json.dump(
+                {"nodes": self.nodes, "labels": [label.value for label in labels]}, f
+            )
+
+        for i, label in enumerate(labels):
+            matrix = self.__label_matrices[label]
+            matrix.sort_indices()
+            for part in ("data", "indices", "indptr"):
+                np.save(os.path.join(path, f"{i}.{part}.npy"), getattr(matrix, part))
+
+    @staticmethod
+    def load(path: str) -> "CompiledGraph":
+        """
+        Loads a graph saved by save. Label matrices are memory-mapped
+        read-only, so loading does not read them and processes loading the
+        same graph share its pages.
+        """
+        with open(os.path.join(path, "graph.json"), "r") as f:
+            tables = json.load(f)
+
+        compiled = CompiledGraph(tables["nodes"])
+        states_count = compiled.number_of_nodes
+        for i, label in enumerate(tables["labels"]):
+            data, indices, indptr = (
+                np.load(os.path.join(path, f"{i}.{part}.npy"), mmap_mode="r")
+                for part in ("data", "indices", "indptr")
+            )
+            compiled.__label_matrices[Symbol(label)] = sparse.csr_matrix(
+                (data, indices, indptr), shape=(states_count, states_count)
+            )
+        return compiled
+
+    @property
+    def nodes(self) -> List[Any]:
+        return [state.value for state in self.__states]
+
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self.__states)
+
+    @property
+    def labels(self) -> KeysView[Symbol]:
+        return self.__label_matrices.keys()
+
+    def __getitem__(self, label: Any) -> sparse.csr_matrix:
+        return self.__label_matrices[label]
+
+    def __contains__(self, node: Any) -> bool:
+        return node in self.__states_indices
+
+    def node_at(self, index: int) -> Any:
+        return self.__states[index].value
+
+    def index_of(self, node: Any) -> int:
+        return self.__states_indices[node]
+
+    def edges(self) -> Iterator[Tuple[Any, Any, Any]]:
+        for label, matrix in self.__label_matrices.items():
+            rows, cols = matrix.nonzero()
+            for row, col in zip(rows, cols):
+                yield self.node_at(row), self.node_at(col), label.value
+
+    def add_nodes(self, nodes: Iterable[Any]) -> None:
+        for node in nodes:
+            if node not in self.__states_indices:
+                state = State(node)
+                self.__states_indices[state] = len(self.__states)
+                self.__states.append(state)
+
+        # matrices are replaced rather than resized in place, since
+        # decompositions handed out earlier may still be reading them
+        states_count = len(self.__states)
+        for label, matrix in self.__label_matrices.items():
+            if matrix.shape[0] != states_count:
+                self.__label_matrices[label] = _resized(matrix, states_count)
+
+    def add_edges(self, edges: Iterable[Tuple[Any, Any, Any]]) -> None:
+        """Adds (source, destination, label) edges; unlabeled edges are skipped."""
+        edges = [edge for edge in edges if edge[2] is not None]
+        self.add_nodes(
+            node for source, destination, _ in edges for node in (source, destination)
+        )
+
+        for label, matrix in self.__edges_matrices(edges).items():
+            if label in self.__label_matrices:
+                self.__label_matrices[label] = self.__label_matrices[label] + matrix
+            else:
+                self.__label_matrices[label] = matrix
+
+    def remove_edges(self, edges: Iterable[Tuple[Any, Any, Any]]) -> None:
+        """Removes (source, destination, label) edges; unknown edges are ignored."""
+        edges = [
+            (source, destination, label)
+            for source, destination, label in edges
+            if source in self and destination in self and label in self.labels
+        ]
+
+        for label, matrix in self.__edges_matrices(edges).items():
+            remaining = self.__label_matrices[label] > matrix
+            if remaining.nnz == 0:
+                del self.__label_matrices[label]
+            else:
+                self.__label_matrices[label] = remaining
+
+    def decomposition(
+        self, start_nodes: Set[Any] = None, final_nodes: Set[Any] = None
+    ) -> au.BooleanDecomposition:
+        """
+        Boolean decomposition of the graph with the given start and final
+        nodes (all nodes if not given). It is a snapshot of the graph, so
+        later updates of the graph do not affect queries over it.
+        """
+        return au.BooleanDecomposition(
+            dict(self.__states_indices),
+            dict(self.__label_matrices),
+            list(self.__states),
+            self.__states_of(start_nodes),
+            self.__states_of(final_nodes),
+        )
+
+    def __states_of(self, nodes: Union[Set[Any], None]) -> Set[State]:
+        if nodes is None:
+            return set(self.__states)
+        return {State(node) for node in nodes if node in self}
+
+    def __edges_matrices(
+        self, edges: List[Tuple[Any, Any, Any]]
+    ) -> Dict[Symbol, sparse.csr_matrix]:
+        return au.build_label_matrices(
+            (
+                (self.index_of(source), Symbol(label), self.index_of(destination))
+                for source, destination, label in edges
+            ),
+            self.number_of_nodes,
+        )
+
+
+def _resized(matrix: sparse.csr_matrix, states_count: int) -> sparse.csr_matrix:
+    """Copy of the square CSR matrix with empty rows and columns appended."""
+    indptr = np.concatenate(
+        [
+            matrix.indptr,
+            np.full(
+                states_count - matrix.shape[0],
+                matrix.indptr[-1],
+                dtype=matrix.indptr.dtype,
+            ),
+        ]
+    )
+    return sparse.csr_matrix(
+        (matrix.data, matrix.indices, indptr), shape=(states_count, states_count)
+    )
+
+
+def compile_graph(graph: Union[MultiDiGraph, CompiledGraph]) -> CompiledGraph:
+    if isinstance(graph, CompiledGraph):
+        return graph
+    return CompiledGraph.from_graph(graph)
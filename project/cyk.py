@@ -0,0 +1,125 @@
+from concurrent.futures import ProcessPoolExecutor
+from pyformlang.cfg import CFG
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from project.cfpq import Productions
+
+
+def _bits(mask: int) -> Iterable[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class CykRecognizer:
+    """
+    CYK recognizer for a grammar compiled once into bitsets: every span of
+    the word is assigned an int whose i-th bit is set if the i-th variable of
+    the grammar's WCNF derives the span.
+
+    WCNF keeps epsilon productions, so a variable also derives a span if it
+    has a production whose other body variable is nullable.
+    """
+
+    def __init__(self, cfg: CFG):
+        prods = Productions(cfg)
+        variables = {var: i for i, var in enumerate(prods.wcnf.variables)}
+
+        self.__start_mask = (
+            1 << variables[prods.wcnf.start_symbol]
+            if prods.wcnf.start_symbol in variables
+            else 0
+        )
+
+        self.__terminal_masks: Dict[str, int] = {}
+        for prod in prods.terminal:
+            terminal = prod.body[0].value
+            self.__terminal_masks[terminal] = self.__terminal_masks.get(terminal, 0) | (
+                1 << variables[prod.head]
+            )
+
+        nullable = 0
+        for prod in prods.epsilon:
+            nullable |= 1 << variables[prod.head]
+        changed = True
+        while changed:
+            changed = False
+            for prod in prods.variable:
+                left, right = (1 << variables[var] for var in prod.body)
+                head = 1 << variables[prod.head]
+                if nullable & left and nullable & right and not nullable & head:
+                    nullable |= head
+                    changed = True
+        self.__nullable_mask = nullable
+
+        # left variable -> [(right variable mask, heads mask)]
+        self.__binary: List[List[Tuple[int, int]]] = [[] for _ in variables]
+        # variable -> heads deriving whatever it derives, through a nullable sibling
+        self.__unit_masks: List[int] = [0] * len(variables)
+        for prod in prods.variable:
+            left, right = (variables[var] for var in prod.body)
+            head = 1 << variables[prod.head]
+            self.__binary[left].append((1 << right, head))
+            if nullable >> right & 1:
+                self.__unit_masks[left] |= head
+            if nullable >> left & 1:
+                self.__unit_masks[right] |= head
+
+    def __close(self, mask: int) -> int:
+        closed = new = mask
+        while new:
+            heads = 0
+            for var in _bits(new):
+                heads |= self.__unit_masks[var]
+            new = heads & ~closed
+            closed |= new
+        return closed
+
+    def __combine(self, left_mask: int, right_mask: int) -> int:
+        heads = 0
+        for left in _bits(left_mask):
+            for right, head in self.__binary[left]:
+                if right_mask & right:
+                    heads |= head
+        return heads
+
+    def recognize(self, word: Sequence[str]) -> bool:
+        n = len(word)
+        if n == 0:
+            return bool(self.__nullable_mask & self.__start_mask)
+
+        # spans[i][length - 1] for the span of the given length starting at i
+        spans = [
+            [self.__close(self.__terminal_masks.get(symbol, 0))] for symbol in word
+        ]
+        for length in range(2, n + 1):
+            for i in range(n - length + 1):
+                mask = 0
+                for split in range(1, length):
+                    left = spans[i][split - 1]
+                    right = spans[i + split][length - split - 1]
+                    if left and right:
+                        mask |= self.__combine(left, right)
+                spans[i].append(self.__close(mask))
+
+        return bool(spans[0][n - 1] & self.__start_mask)
+
+    def recognize_all(
+        self, words: Iterable[Sequence[str]], processes: int = None
+    ) -> List[bool]:
+        """
+        Recognizes every word; with processes set, words are spread over a
+        pool of that many worker processes.
+        """
+        if processes is None:
+            return [self.recognize(word) for word in words]
+
+        words = list(words)
+        chunksize = max(1, len(words) // (4 * processes))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(self.recognize, words, chunksize=chunksize))
+
+
+def cyk(cfg: CFG, word: Sequence[str]) -> bool:
+    return CykRecognizer(cfg).recognize(word)
@@ -0,0 +1,91 @@
+from collections import defaultdict, deque
+from pyformlang.cfg import Variable
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from project.compiled_graph import CompiledGraph
+from project.rsm import Rsm
+
+
+def _box_transitions(rsm: Rsm) -> Dict[Tuple[Variable, Any], List[Tuple[Any, Any]]]:
+    transitions = defaultdict(list)
+    for nonterm, fa in rsm.boxes.items():
+        for source, label, destination in fa:
+            transitions[(nonterm, source)].append((label, (nonterm, destination)))
+    return transitions
+
+
+def gll(
+    rsm: Rsm, graph: CompiledGraph, calls: Iterable[Tuple[Variable, int]]
+) -> Set[Tuple[int, Variable, int]]:
+    """
+    GLL-style CFPQ over the boxes of rsm and the graph: descriptors
+    (RSM state, GSS node, vertex) are processed from a worklist, and a GSS
+    node (N, u) stands for a call of box N at vertex u shared by all of its
+    callers. Only the calls reachable from the given (nonterminal, vertex
+    index) calls are explored.
+
+    Returns (u, N, v) triples of vertex indices such that N derives a path
+    from u to v, for every call (N, u) that has been made.
+    """
+    transitions = _box_transitions(rsm)
+    nonterms = {nonterm.value: nonterm for nonterm in rsm.boxes}
+    final_states = {
+        (nonterm, state)
+        for nonterm, fa in rsm.boxes.items()
+        for state in fa.final_states
+    }
+    start_states = {
+        nonterm: [(nonterm, state) for state in fa.start_states]
+        for nonterm, fa in rsm.boxes.items()
+    }
+    successors = {
+        label.value: (graph[label].indptr, graph[label].indices)
+        for label in graph.labels
+    }
+
+    # GSS node -> {(return RSM state, caller GSS node)}
+    gss = {}
+    popped = defaultdict(set)
+    descriptors = set()
+    worklist = deque()
+
+    def add(descriptor):
+        if descriptor not in descriptors:
+            descriptors.add(descriptor)
+            worklist.append(descriptor)
+
+    def call(nonterm, vertex, return_state=None, caller=None):
+        node = (nonterm, vertex)
+        if node not in gss:
+            gss[node] = set()
+            for state in start_states.get(nonterm, ()):
+                add((state, node, vertex))
+        if caller is not None and (return_state, caller) not in gss[node]:
+            gss[node].add((return_state, caller))
+            for end in popped[node]:
+                add((return_state, caller, end))
+
+    for nonterm, vertex in calls:
+        call(nonterm, vertex)
+
+    while worklist:
+        state, node, vertex = worklist.popleft()
+
+        if state in final_states and vertex not in popped[node]:
+            popped[node].add(vertex)
+            for return_state, caller in gss[node]:
+                add((return_state, caller, vertex))
+
+        for label, next_state in transitions.get(state, ()):
+            if label.value in nonterms:
+                call(nonterms[label.value], vertex, next_state, node)
+            elif label.value in successors:
+                indptr, indices = successors[label.value]
+                for next_vertex in indices[indptr[vertex] : indptr[vertex + 1]]:
+                    add((next_state, node, int(next_vertex)))
+
+    return {
+        (start, nonterm, end)
+        for (nonterm, start), ends in popped.items()
+        for end in ends
+    }
@@ -0,0 +1,226 @@
+import sys
+from antlr4 import ParserRuleContext, TerminalNode
+from typing import Any, Callable, Dict, List, TextIO
+
+from project.graph_query_lang import plans
+from project.graph_query_lang.langParser import langParser
+from project.graph_query_lang.parser import parse
+from project.graph_query_lang.plans import GraphPlan, Lazy, force
+
+Env = Dict[str, Any]
+
+
+def _rule(node) -> str:
+    """Grammar rule of a parse tree node, or None for a token."""
+    if isinstance(node, TerminalNode):
+        return None
+    # underscores keep names such as graph_ from clashing with keywords
+    return langParser.ruleNames[node.getRuleIndex()].rstrip("_")
+
+
+def _children(ctx: ParserRuleContext) -> List:
+    return list(ctx.children or [])
+
+
+def _tokens(ctx: ParserRuleContext) -> List[str]:
+    return [child.getText() for child in _children(ctx) if _rule(child) is None]
+
+
+def show(value: Any) -> str:
+    """Value as it is printed: sets are sorted, so output is deterministic."""
+    value = force(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return f'"{value}"'
+    if isinstance(value, (set, frozenset)):
+        try:
+            items = sorted(value)
+        except TypeError:
+            items = sorted(value, key=show)
+        return f"[{', '.join(show(item) for item in items)}]"
+    if isinstance(value, tuple):
+        return f"({', '.join(show(item) for item in value)})"
+    if isinstance(value, GraphPlan):
+        return show(value.get_edges())
+    return str(value)
+
+
+class Interpreter:
+    """
+    Evaluates graph query language programs by walking their parse trees.
+    Expressions evaluate to lazy plans, which are only forced by print, so
+    a pipeline of graph stages or language operations costs nothing until
+    its result is printed; queries then run on the rpq and cfpq engines.
+    """
+
+    def __init__(self, out: TextIO = sys.stdout):
+        self.env: Env = {}
+        self.__out = out
+
+    def run(self, text: str) -> None:
+        parser = parse(text)
+        tree = parser.prog()
+
+        if parser.getNumberOfSyntaxErrors() > 0:
+            raise ValueError("Given program contains syntax errors")
+
+        for child in _children(tree):
+            if _rule(child) == "stmt":
+                self.__stmt(child)
+
+    def run_file(self, path: str) -> None:
+        with open(path, "r") as f:
+            self.run(f.read())
+
+    def __stmt(self, ctx: ParserRuleContext) -> None:
+        children = _children(ctx)
+        if len(children) == 0:
+            return
+        keyword = children[0].getText()
+        if keyword == "print":
+            print(show(self.__expr(children[1], self.env)), file=self.__out)
+        elif keyword == "let":
+            self.env[children[1].getText()] = self.__expr(children[3], self.env)
+
+    def __eval(self, ctx: ParserRuleContext, env: Env) -> Any:
+        return getattr(self, f"_Interpreter__{_rule(ctx)}")(ctx, env)
+
+    def __expr(self, ctx: ParserRuleContext, env: Env) -> Any:
+        children = _children(ctx)
+        if len(children) == 1:
+            return self.__eval(children[0], env)
+        if len(children) == 2 and _rule(children[0]) == "unop":
+            operation = _unops[children[0].getText()]
+            operand = self.__eval(children[1], env)
+            return Lazy(lambda: operation(force(operand)))
+        if len(children) == 2:
+            operand = self.__eval(children[0], env)
+            return Lazy(lambda: plans.star(force(operand)))
+        if len(children) == 3:
+            operation = _binops[children[1].getText()]
+            left = self.__eval(children[0], env)
+            right = self.__eval(children[2], env)
+            return Lazy(lambda: operation(force(left), force(right)))
+        raise ValueError(f"Cannot evaluate empty expression {ctx.getText()}")
+
+    def __var(self, ctx: ParserRuleContext, env: Env) -> Any:
+        name = ctx.getText()
+        if name in env:
+            return env[name]
+        # true and false are lexed as identifiers, so they can be shadowed
+        if name in ("true", "false"):
+            return name == "true"
+        raise ValueError(f"Unknown variable {name}")
+
+    def __val(self, ctx: ParserRuleContext, env: Env) -> Any:
+        return self.__eval(_children(ctx)[0], env)
+
+    def __string(self, ctx: ParserRuleContext, env: Env) -> str:
+        return ctx.getText()[1:-1]
+
+    def __int(self, ctx: ParserRuleContext, env: Env) -> int:
+        return int(ctx.getText())
+
+    def __bool(self, ctx: ParserRuleContext, env: Env) -> bool:
+        return ctx.getText() == "true"
+
+    def __regex(self, ctx: ParserRuleContext, env: Env) -> plans.RegexPlan:
+        return plans.RegexPlan(ctx.getText()[2:-2])
+
+    def __cfg(self, ctx: ParserRuleContext, env: Env) -> plans.CfgPlan:
+        return plans.cfg_from_text(ctx.getText()[2:-2])
+
+    def __graph(self, ctx: ParserRuleContext, env: Env) -> Any:
+        children = _children(ctx)
+        tokens = _tokens(ctx)
+        if tokens == ["load"]:
+            return GraphPlan.load(self.__eval(children[1], env))
+        if tokens == ["|>"]:
+            stage = self.__semigraph(children[2], env)
+            graph = self.__eval(children[0], env)
+        elif tokens == ["(", ")"]:
+            stage = self.__semigraph(children[0], env)
+            graph = self.__eval(children[2], env)
+        else:
+            return self.__eval(children[0], env)
+        return Lazy(lambda: stage(force(graph)))
+
+    def __semigraph(
+        self, ctx: ParserRuleContext, env: Env
+    ) -> Callable[[GraphPlan], GraphPlan]:
+        children = _children(ctx)
+        if len(children) == 0:
+            return lambda graph: graph
+        nodes = self.__eval(children[1], env)
+        # the stage takes the lazy set, so the set is only computed by a query
+        return lambda graph: getattr(graph, children[0].getText())(nodes)
+
+    def __set(self, ctx: ParserRuleContext, env: Env) -> Any:
+        children = _children(ctx)
+        tokens = _tokens(ctx)
+        if len(children) == 1:
+            return self.__eval(children[0], env)
+        if tokens and tokens[0].startswith("get_"):
+            graph = self.__eval(children[1], env)
+            return Lazy(lambda: getattr(force(graph), tokens[0])())
+        if tokens == ["|>"]:
+            semiset = self.__semiset(children[2], env)
+            return semiset(self.__eval(children[0], env))
+        if tokens == ["(", ")"]:
+            semiset = self.__semiset(children[0], env)
+            return semiset(self.__eval(children[2], env))
+        if tokens == ["[", "..", "]"]:
+            first = self.__eval(children[1], env)
+            last = self.__eval(children[3], env)
+            return Lazy(lambda: frozenset(range(force(first), force(last) + 1)))
+        items = [self.__eval(child, env) for child in children if _rule(child)]
+        return Lazy(lambda: frozenset(force(item) for item in items))
+
+    def __semiset(self, ctx: ParserRuleContext, env: Env) -> Callable[[Any], Lazy]:
+        children = _children(ctx)
+        if len(children) == 0:
+            return lambda values: values
+        function = self.__lambda(children[1], env)
+        if children[0].getText() == "map":
+            return lambda values: Lazy(
+                lambda: frozenset(function(value) for value in force(values))
+            )
+        return lambda values: Lazy(
+            lambda: frozenset(value for value in force(values) if function(value))
+        )
+
+    def __lambda(self, ctx: ParserRuleContext, env: Env) -> Callable[[Any], Any]:
+        children = _children(ctx)
+        if len(children) == 0:
+            return lambda value: value
+        if _rule(children[1]) == "lambda":
+            return self.__lambda(children[1], env)
+
+        names = [child.getText() for child in children if _rule(child) == "var"]
+        body = children[-1]
+        # bindings made after the lambda must not change its meaning
+        closure = dict(env)
+
+        def function(value):
+            values = value if len(names) > 1 else (value,)
+            if len(values) != len(names):
+                raise ValueError(f"Cannot bind {show(value)} to {', '.join(names)}")
+            return force(self.__expr(body, {**closure, **dict(zip(names, values))}))
+
+        return function
+
+
+_unops = {
+    "not": lambda value: not value,
+    "-": lambda value: -value,
+}
+
+_binops = {
+    "&": plans.intersect,
+    "|": plans.union,
+    ".": plans.concat,
+    "&&": lambda left, right: left and right,
+    "||": lambda left, right: left or right,
+    "in": lambda value, values: value in values,
+}
@@ -0,0 +1,324 @@
+from networkx import MultiDiGraph
+from pyformlang.cfg import CFG, Variable
+from pyformlang.finite_automaton import FiniteAutomaton
+from pyformlang.regular_expression import Regex
+from typing import Any, Callable, FrozenSet, Set, Tuple, Union
+import cfpq_data
+import networkx as nx
+import numpy as np
+import os
+
+import project.automata_utils as au
+from project.cfpq import cfpq
+from project.compiled_graph import CompiledGraph
+from project.rpq import _compile_regex, automaton_rpq, intersection_rpq
+
+
+class Lazy:
+    """Value computed by compute the first time it is forced."""
+
+    def __init__(self, compute: Callable[[], Any]):
+        self.__compute = compute
+        self.__forced = False
+        self.__value = None
+
+    def force(self) -> Any:
+        if not self.__forced:
+            self.__value = force(self.__compute())
+            self.__forced = True
+            self.__compute = None
+        return self.__value
+
+
+def force(value: Any) -> Any:
+    return value.force() if isinstance(value, Lazy) else value
+
+
+def _read_graph(path: str) -> MultiDiGraph:
+    """
+    Graph from the dot file path, or the cfpq_data dataset named path if
+    there is no such file. Numeric node
+    names of dot files are read as ints, so that they can be given by the
+    int literals of the language.
+    """
+    if os.path.exists(path):
+        graph = nx.drawing.nx_agraph.read_dot(path)
+        return nx.relabel_nodes(
+            graph, lambda node: int(node) if node.isdigit() else node
+        )
+    return cfpq_data.graph_from_csv(cfpq_data.download(path))
+
+
+class GraphPlan:
+    """
+    Graph with start and final nodes (all nodes if None), evaluated lazily.
+    Pipeline stages return new plans sharing the same lazy graph, so the
+    graph is neither loaded nor copied until a query over it is forced.
+    """
+
+    def __init__(
+        self,
+        graph: Lazy,
+        start: Union[Lazy, Set[Any], None] = None,
+        final: Union[Lazy, Set[Any], None] = None,
+    ):
+        self.__graph = graph
+        self.__start = start
+        self.__final = final
+
+    @staticmethod
+    def load(path: str) -> "GraphPlan":
+        return GraphPlan(Lazy(lambda: CompiledGraph.from_graph(_read_graph(path))))
+
+    @staticmethod
+    def from_graph(graph: Union[MultiDiGraph, CompiledGraph]) -> "GraphPlan":
+        if isinstance(graph, CompiledGraph):
+            return GraphPlan(Lazy(lambda: graph))
+        return GraphPlan(Lazy(lambda: CompiledGraph.from_graph(graph)))
+
+    @property
+    def graph(self) -> CompiledGraph:
+        return self.__graph.force()
+
+    @property
+    def start(self) -> Union[Set[Any], None]:
+        return None if self.__start is None else set(force(self.__start))
+
+    @property
+    def final(self) -> Union[Set[Any], None]:
+        return None if self.__final is None else set(force(self.__final))
+
+    def set_start(self, nodes: Union[Lazy, Set[Any]]) -> "GraphPlan":
+        return GraphPlan(self.__graph, nodes, self.__final)
+
+    def set_final(self, nodes: Union[Lazy, Set[Any]]) -> "GraphPlan":
+        return GraphPlan(self.__graph, self.__start, nodes)
+
+    def add_start(self, nodes: Union[Lazy, Set[Any]]) -> "GraphPlan":
+        return self.set_start(Lazy(lambda: self.get_start() | force(nodes)))
+
+    def add_final(self, nodes: Union[Lazy, Set[Any]]) -> "GraphPlan":
+        return self.set_final(Lazy(lambda: self.get_final() | force(nodes)))
+
+    def get_vertices(self) -> FrozenSet[Any]:
+        return frozenset(self.graph.nodes)
+
+    def get_edges(self) -> FrozenSet[Tuple[Any, Any, Any]]:
+        return frozenset(
+            (source, label, destination)
+            for source, destination, label in self.graph.edges()
+        )
+
+    def get_labels(self) -> FrozenSet[Any]:
+        return frozenset(label.value for label in self.graph.labels)
+
+    def get_start(self) -> FrozenSet[Any]:
+        start = self.start
+        return self.get_vertices() if start is None else frozenset(start)
+
+    def get_final(self) -> FrozenSet[Any]:
+        final = self.final
+        return self.get_vertices() if final is None else frozenset(final)
+
+    def get_reachable(self) -> FrozenSet[Tuple[Any, Any]]:
+        """Pairs of start and final nodes connected by a nonempty path."""
+        decomp = self.graph.decomposition(self.start, self.final)
+        closure = au.transitive_closure_boolean(
+            decomp,
+            sources=np.flatnonzero(decomp.start_mask),
+            targets=np.flatnonzero(decomp.final_mask),
+        )
+        rows, cols = closure.nonzero()
+        return frozenset(
+            (decomp.state_at(row).value, decomp.state_at(col).value)
+            for row, col in zip(rows.tolist(), cols.tolist())
+        )
+
+    def query(self, language: "LanguagePlan") -> Lazy:
+        """Pairs of start and final nodes connected by a path in the language."""
+
+        def run():
+            start, final = self.start, self.final
+            if start is not None and len(start) == 0:
+                return frozenset()
+            if isinstance(language, CfgPlan):
+                cfg = language.cfg
+                pairs = cfpq(cfg, self.graph, "matrix", start, final, cfg.start_symbol)
+            elif isinstance(language, RegexPlan):
+                pairs = intersection_rpq(language.text, self.graph, start, final)
+            else:
+                pairs = automaton_rpq(
+                    au.BooleanDecomposition.from_fa(language.automaton.minimize()),
+                    self.graph,
+                    start,
+                    final,
+                )
+            return frozenset(pairs)
+
+        return Lazy(run)
+
+
+class RegexPlan:
+    """Regular expression; operations over regexes only build its text."""
+
+    def __init__(self, text: str):
+        self.__text = text
+
+    @property
+    def text(self) -> str:
+        return self.__text
+
+    @property
+    def automaton(self) -> FiniteAutomaton:
+        # the compiled DFA is shared through the regex cache and never modified
+        return _compile_regex(self.__text)[0]
+
+    @property
+    def cfg(self) -> CFG:
+        return Regex(self.__text).to_cfg()
+
+    def __str__(self) -> str:
+        return f'{{"{self.__text}"}}'
+
+
+class AutomatonPlan:
+    """Regular language that is not written as a regex, e.g. an intersection."""
+
+    def __init__(self, automaton: Lazy):
+        self.__automaton = automaton
+
+    @property
+    def automaton(self) -> FiniteAutomaton:
+        return self.__automaton.force()
+
+    @property
+    def cfg(self) -> CFG:
+        return self.automaton.to_regex().to_cfg()
+
+    def __str__(self) -> str:
+        return f'{{"{self.automaton.minimize().to_regex()}"}}'
+
+
+class CfgPlan:
+    """Context-free language; cfg must be queried from its own start symbol."""
+
+    def __init__(self, cfg: Lazy):
+        self.__cfg = cfg
+
+    @property
+    def cfg(self) -> CFG:
+        return self.__cfg.force()
+
+    def __str__(self) -> str:
+        return f"{{| {' | '.join(self.cfg.to_text().splitlines())} |}}"
+
+
+LanguagePlan = Union[RegexPlan, AutomatonPlan, CfgPlan]
+_regular = (RegexPlan, AutomatonPlan)
+
+
+def cfg_from_text(text: str) -> CfgPlan:
+    """
+    Grammar from productions separated by "|"; a part without "->" is one
+    more body of the previous head. The first head is the start symbol.
+    """
+    lines = []
+    for part in text.split("|"):
+        if "->" in part or not lines:
+            lines.append(part.strip())
+        else:
+            lines[-1] += f" | {part.strip()}"
+    start = lines[0].split("->")[0].strip()
+    return CfgPlan(Lazy(lambda: CFG.from_text("\n".join(lines), Variable(start))))
+
+
+def _language(value: Any) -> Union[LanguagePlan, None]:
+    if isinstance(value, str):
+        return RegexPlan(value)
+    if isinstance(value, (RegexPlan, AutomatonPlan, CfgPlan)):
+        return value
+    return None
+
+
+def _unsupported(operation: str, *values: Any) -> ValueError:
+    types = ", ".join(type(value).__name__ for value in values)
+    return ValueError(f"{operation} is not defined for {types}")
+
+
+def intersect(left: Any, right: Any) -> Any:
+    """
+    & of the language: set intersection, intersection of a regular language
+    with a regular or context-free one, or the query of a graph by a language.
+    """
+    if isinstance(left, (set, frozenset)) and isinstance(right, (set, frozenset)):
+        return frozenset(left) & frozenset(right)
+    if isinstance(right, GraphPlan):
+        left, right = right, left
+    if isinstance(left, GraphPlan):
+        language = _language(right)
+        if language is None:
+            raise _unsupported("&", left, right)
+        return left.query(language)
+
+    left_language, right_language = _language(left), _language(right)
+    if isinstance(left_language, _regular) and isinstance(right_language, _regular):
+        return AutomatonPlan(
+            Lazy(
+                lambda: left_language.automaton.get_intersection(
+                    right_language.automaton
+                )
+            )
+        )
+    if isinstance(left_language, CfgPlan) and isinstance(right_language, _regular):
+        left_language, right_language = right_language, left_language
+    if isinstance(left_language, _regular) and isinstance(right_language, CfgPlan):
+        return CfgPlan(
+            Lazy(
+                lambda: right_language.cfg.intersection(
+                    left_language.automaton.to_deterministic()
+                )
+            )
+        )
+    raise _unsupported("&", left, right)
+
+
+def union(left: Any, right: Any) -> Any:
+    """| of the language: set union or union of languages."""
+    if isinstance(left, (set, frozenset)) and isinstance(right, (set, frozenset)):
+        return frozenset(left) | frozenset(right)
+    left_language, right_language = _language(left), _language(right)
+    if isinstance(left_language, RegexPlan) and isinstance(right_language, RegexPlan):
+        return RegexPlan(f"({left_language.text})|({right_language.text})")
+    if isinstance(left_language, _regular) and isinstance(right_language, _regular):
+        return AutomatonPlan(
+            Lazy(lambda: left_language.automaton.union(right_language.automaton))
+        )
+    if left_language is not None and right_language is not None:
+        return CfgPlan(Lazy(lambda: left_language.cfg.union(right_language.cfg)))
+    raise _unsupported("|", left, right)
+
+
+def concat(left: Any, right: Any) -> Any:
+    """. of the language: concatenation of languages."""
+    left_language, right_language = _language(left), _language(right)
+    if isinstance(left_language, RegexPlan) and isinstance(right_language, RegexPlan):
+        return RegexPlan(f"({left_language.text}).({right_language.text})")
+    if isinstance(left_language, _regular) and isinstance(right_language, _regular):
+        return AutomatonPlan(
+            Lazy(lambda: left_language.automaton.concatenate(right_language.automaton))
+        )
+    if left_language is not None and right_language is not None:
+        return CfgPlan(Lazy(lambda: left_language.cfg.concatenate(right_language.cfg)))
+    raise _unsupported(".", left, right)
+
+
+def star(value: Any) -> Any:
+    """* of the language: Kleene star of a language."""
+    language = _language(value)
+    if isinstance(language, RegexPlan):
+        return RegexPlan(f"({language.text})*")
+    if isinstance(language, AutomatonPlan):
+        return AutomatonPlan(Lazy(lambda: language.automaton.kleene_star()))
+    if isinstance(language, CfgPlan):
+        return CfgPlan(Lazy(lambda: language.cfg.get_closure()))
+    raise _unsupported("*", value)
@@ -0,0 +1,45 @@
+from typing import Any, Callable, Iterator, List, Set, Tuple
+import numpy as np
+
+
+class IndexPairs:
+    """
+    Query answer kept as NumPy arrays of start and final indices, decoded to
+    (start, final) pairs by node_at only while being iterated, one chunk at
+    a time, so that it can be streamed without building the set of pairs.
+    """
+
+    def __init__(
+        self, starts: np.ndarray, finals: np.ndarray, node_at: Callable[[int], Any]
+    ):
+        self.__starts = np.asarray(starts)
+        self.__finals = np.asarray(finals)
+        self.__node_at = node_at
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.__starts
+
+    @property
+    def finals(self) -> np.ndarray:
+        return self.__finals
+
+    def __len__(self) -> int:
+        return self.__starts.size
+
+    def chunks(self, size: int = 1 << 16) -> Iterator[List[Tuple[Any, Any]]]:
+        for begin in range(0, len(self), size):
+            yield [
+                (self.__node_at(start), self.__node_at(final))
+                for start, final in zip(
+                    self.__starts[begin : begin + size].tolist(),
+                    self.__finals[begin : begin + size].tolist(),
+                )
+            ]
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        for chunk in self.chunks():
+            yield from chunk
+
+    def to_set(self) -> Set[Tuple[Any, Any]]:
+        return set(self)
@@ -0,0 +1,343 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from scipy import sparse
+from threading import Lock, local
+from typing import Iterator, List, Tuple
+import numpy as np
+
+_WORD = np.dtype("<u8")
+# number of set bits of every byte; np.bitwise_count needs numpy 2
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+_FORMATS = ("bsr", "coo", "csc", "csr", "dia", "dok", "lil")
+
+# counters of the count_conversions blocks being run, by their ids
+_counters = {}
+# original conversion methods of the scipy classes while counters are active
+_patched_methods = {}
+# guards both of the above, since blocks may be entered by several threads
+_counting_lock = Lock()
+# conversion methods call each other (e.g. through super()), so only the
+# outermost call of a thread is reported
+_converting = local()
+
+
+def _notify_conversion(source: str, target: str) -> None:
+    if not _counters:
+        return
+    with _counting_lock:
+        for counter in _counters.values():
+            counter[(source, target)] += 1
+
+
+def _counting(method, target: str):
+    @wraps(method)
+    def convert(self, *args, **kwargs):
+        if getattr(_converting, "active", False):
+            return method(self, *args, **kwargs)
+        if self.format != target:
+            _notify_conversion(self.format, target)
+        _converting.active = True
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _converting.active = False
+
+    return convert
+
+
+def _patch_scipy() -> None:
+    for fmt in _FORMATS:
+        for cls in (getattr(sparse, f"{fmt}_matrix"), getattr(sparse, f"{fmt}_array")):
+            for klass in cls.__mro__:
+                for target in _FORMATS:
+                    name = f"to{target}"
+                    if name in klass.__dict__ and (klass, name) not in _patched_methods:
+                        method = klass.__dict__[name]
+                        _patched_methods[(klass, name)] = method
+                        setattr(klass, name, _counting(method, target))
+
+
+def _unpatch_scipy() -> None:
+    for (klass, name), method in _patched_methods.items():
+        setattr(klass, name, method)
+    _patched_methods.clear()
+
+
+@contextmanager
+def count_conversions() -> Iterator[Counter]:
+    """
+    Counts (source, target) conversions between scipy sparse formats and bit
+    matrices made inside the block, by any thread. It is meant for tests and
+    profiling: only while a block is running are the conversion methods of
+    scipy sparse classes wrapped, and they are restored when the last one
+    exits.
+    """
+    conversions = Counter()
+    with _counting_lock:
+        if not _counters:
+            _patch_scipy()
+        _counters[id(conversions)] = conversions
+    try:
+        yield conversions
+    finally:
+        with _counting_lock:
+            del _counters[id(conversions)]
+            if not _counters:
+                _unpatch_scipy()
+
+
+def csr_from_coords(rows, cols, shape: Tuple[int, int]) -> sparse.csr_matrix:
+    """Boolean CSR matrix with the given entries, duplicates merged."""
+    rows = np.asarray(rows, dtype=np.int64)
+    return sparse.coo_matrix(
+        (np.ones(rows.size, dtype=bool), (rows, np.asarray(cols, dtype=np.int64))),
+        shape=shape,
+    ).tocsr()
+
+
+def csr_from_keys(keys: np.ndarray, shape: Tuple[int, int]) -> sparse.csr_matrix:
+    """
+    Boolean CSR matrix with the entries at the row * shape[1] + col keys,
+    duplicates merged. Sorted keys are entries in CSR order, so the matrix
+    is laid out directly rather than converted from COO.
+    """
+    keys = np.sort(np.asarray(keys, dtype=np.int64))
+    keys = keys[np.diff(keys, prepend=-1) != 0]
+    rows, cols = np.divmod(keys, max(shape[1], 1))
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+    return sparse.csr_matrix(
+        (np.ones(keys.size, dtype=bool), cols, indptr), shape=shape
+    )
+
+
+def csr_nonzero(matrix: sparse.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+    """Same as matrix.nonzero(), which goes through a COO copy of the matrix."""
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    stored = matrix.data != 0
+    return rows[stored], matrix.indices[stored]
+
+
+def csr_diagonal(mask: np.ndarray) -> sparse.csr_matrix:
+    """Diagonal matrix with the mask on its diagonal, built directly as CSR."""
+    indptr = np.zeros(mask.size + 1, dtype=np.int64)
+    np.cumsum(mask, out=indptr[1:])
+    indices = np.flatnonzero(mask)
+    return sparse.csr_matrix(
+        (np.ones(indices.size, dtype=bool), indices, indptr),
+        shape=(mask.size, mask.size),
+    )
+
+
+class BitMatrix:
+    """
+    Dense boolean matrix with rows packed into little-endian uint64 words:
+    column j of a row is bit j % 64 of its word j // 64. Supports the subset
+    of the scipy sparse boolean matrix interface used by the algorithms:
+    @ (boolean product), + (or), > (and not), nnz and nonzero().
+    """
+
+    def __init__(self, words: np.ndarray, cols_count: int):
+        self.__words = words
+        self.__cols_count = cols_count
+
+    @staticmethod
+    def zeros(shape: Tuple[int, int]) -> "BitMatrix":
+        rows_count, cols_count = shape
+        return BitMatrix(
+            np.zeros((rows_count, (cols_count + 63) // 64), dtype=_WORD), cols_count
+        )
+
+    @staticmethod
+    def from_coords(rows, cols, shape: Tuple[int, int]) -> "BitMatrix":
+        matrix = BitMatrix.zeros(shape)
+        cols = np.asarray(cols, dtype=np.uint64)
+        np.bitwise_or.at(
+            matrix.__words,
+            (np.asarray(rows, dtype=np.int64), (cols >> np.uint64(6)).astype(np.int64)),
+            np.uint64(1) << (cols & np.uint64(63)),
+        )
+        return matrix
+
+    @staticmethod
+    def from_csr(matrix: sparse.csr_matrix) -> "BitMatrix":
+        _notify_conversion("csr", "bitset")
+        rows, cols = csr_nonzero(matrix)
+        return BitMatrix.from_coords(rows, cols, matrix.shape)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.__words.shape[0], self.__cols_count
+
+    @property
+    def words(self) -> np.ndarray:
+        return self.__words
+
+    @property
+    def nnz(self) -> int:
+        return int(_POPCOUNT[self.__words.view(np.uint8)].sum(dtype=np.int64))
+
+    def toarray(self) -> np.ndarray:
+        unpacked = np.unpackbits(
+            self.__words.view(np.uint8),
+            axis=1,
+            count=self.__cols_count,
+            bitorder="little",
+        )
+        return unpacked.astype(bool)
+
+    def tocsr(self) -> sparse.csr_matrix:
+        _notify_conversion("bitset", "csr")
+        return sparse.csr_matrix(self.toarray())
+
+    def nonzero(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.toarray().nonzero()
+
+    def copy(self) -> "BitMatrix":
+        return BitMatrix(self.__words.copy(), self.__cols_count)
+
+    def __add__(self, other: "BitMatrix") -> "BitMatrix":
+        return BitMatrix(self.__words | other.__words, self.__cols_count)
+
+    def __gt__(self, other: "BitMatrix") -> "BitMatrix":
+        return BitMatrix(self.__words & ~other.__words, self.__cols_count)
+
+    def __matmul__(self, other: "BitMatrix") -> "BitMatrix":
+        """
+        Four Russians product: rows of other are taken in groups of eight, the
+        ORs of all 256 subsets of a group are tabulated, and every byte of a
+        row of self selects its group's subset with a single lookup.
+        """
+        result = np.zeros((self.__words.shape[0], other.__words.shape[1]), dtype=_WORD)
+        table = np.zeros((256, other.__words.shape[1]), dtype=_WORD)
+        row_bytes = self.__words.view(np.uint8)
+        groups_count = (self.__cols_count + 7) // 8
+
+        for group in np.flatnonzero(row_bytes[:, :groups_count].any(axis=0)):
+            block = other.__words[8 * group : 8 * group + 8]
+            for bit, row in enumerate(block):
+                np.bitwise_or(table[: 1 << bit], row, out=table[1 << bit : 2 << bit])
+            column = row_bytes[:, group]
+            rows = np.flatnonzero(column)
+            result[rows] |= table[column[rows]]
+
+        return BitMatrix(result, other.__cols_count)
+
+
+class SparseBackend:
+    """scipy CSR boolean matrices."""
+
+    name = "sparse"
+
+    @staticmethod
+    def from_csr(matrix) -> sparse.csr_matrix:
+        return sparse.csr_matrix(matrix, dtype=bool)
+
+    @staticmethod
+    def to_csr(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+        return matrix
+
+    @staticmethod
+    def zeros(shape: Tuple[int, int]) -> sparse.csr_matrix:
+        return sparse.csr_matrix(shape, dtype=bool)
+
+    @staticmethod
+    def eye(n: int) -> sparse.csr_matrix:
+        return sparse.eye(n, dtype=bool, format="csr")
+
+    @staticmethod
+    def nonempty_rows(matrix: sparse.csr_matrix) -> np.ndarray:
+        return np.flatnonzero(np.diff(matrix.indptr))
+
+    @staticmethod
+    def move_rows(
+        matrix: sparse.csr_matrix, sources, targets, rows_count: int
+    ) -> sparse.csr_matrix:
+        """Matrix whose row targets[i] is the OR of rows sources[i] of matrix."""
+        # the selection matrix is laid out as CSR directly: its row t holds
+        # the sources moved to t, in the order they are given
+        targets = np.asarray(targets, dtype=np.int64)
+        order = np.argsort(targets, kind="stable")
+        indptr = np.zeros(rows_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=rows_count), out=indptr[1:])
+        selection = sparse.csr_matrix(
+            (
+                np.ones(targets.size, dtype=bool),
+                np.asarray(sources, dtype=np.int64)[order],
+                indptr,
+            ),
+            shape=(rows_count, matrix.shape[0]),
+        )
+        return selection @ matrix
+
+    @staticmethod
+    def union(matrices: List[sparse.csr_matrix], shape) -> sparse.csr_matrix:
+        """OR of the matrices, computed at once rather than pairwise."""
+        keys = [np.zeros(0, dtype=np.int64)]
+        for matrix in matrices:
+            rows, cols = csr_nonzero(matrix)
+            keys.append(rows.astype(np.int64) * shape[1] + cols)
+        return csr_from_keys(np.concatenate(keys), shape)
+
+
+class BitsetBackend:
+    """BitMatrix, for matrices that are dense enough to pay for all their bits."""
+
+    name = "bitset"
+
+    @staticmethod
+    def from_csr(matrix) -> BitMatrix:
+        return BitMatrix.from_csr(sparse.csr_matrix(matrix, dtype=bool))
+
+    @staticmethod
+    def to_csr(matrix: BitMatrix) -> sparse.csr_matrix:
+        return matrix.tocsr()
+
+    @staticmethod
+    def zeros(shape: Tuple[int, int]) -> BitMatrix:
+        return BitMatrix.zeros(shape)
+
+    @staticmethod
+    def eye(n: int) -> BitMatrix:
+        return BitMatrix.from_coords(np.arange(n), np.arange(n), (n, n))
+
+    @staticmethod
+    def nonempty_rows(matrix: BitMatrix) -> np.ndarray:
+        return np.flatnonzero(matrix.words.any(axis=1))
+
+    @staticmethod
+    def move_rows(matrix: BitMatrix, sources, targets, rows_count: int) -> BitMatrix:
+        """Matrix whose row targets[i] is the OR of rows sources[i] of matrix."""
+        moved = BitMatrix.zeros((rows_count, matrix.shape[1]))
+        np.bitwise_or.at(moved.words, np.asarray(targets), matrix.words[sources])
+        return moved
+
+    @staticmethod
+    def union(matrices: List[BitMatrix], shape) -> BitMatrix:
+        result = BitMatrix.zeros(shape)
+        for matrix in matrices:
+            result.words[...] |= matrix.words
+        return result
+
+
+backends = {backend.name: backend for backend in (SparseBackend, BitsetBackend)}
+
+# dense matrices bigger than this many bits are never used
+BITSET_MAX_CELLS = 1 << 28
+# fraction of set entries from which a matrix is stored densely
+BITSET_MIN_DENSITY = 0.01
+
+
+def choose_backend(shape: Tuple[int, int], nnz: int, backend: str = None):
+    """
+    The backend named backend, or, if it is not given, the one suiting a
+    matrix of the given shape with nnz set entries.
+    """
+    if backend is not None:
+        return backends[backend]
+    cells = shape[0] * shape[1]
+    if 0 < cells <= BITSET_MAX_CELLS and nnz >= BITSET_MIN_DENSITY * cells:
+        return BitsetBackend
+    return SparseBackend
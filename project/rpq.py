@@ -1,42 +1,211 @@
+from functools import partial
 from networkx import MultiDiGraph
+from pyformlang.finite_automaton import DeterministicFiniteAutomaton, State
+from typing import List, Set, Tuple, Union
+import numpy as np
 
 import project.automata_utils as fau
+from project.cache import LruCache
+from project.compiled_graph import CompiledGraph, compile_graph
+from project.index_pairs import IndexPairs
+from project.sharding import run_sharded
+
+
+def _as_states(nodes: set):
+    return None if nodes is None else {State(node) for node in nodes}
+
+
+regex_cache = LruCache(max_size=512)
+
+
+def _compile_regex(
+    regex: str,
+) -> Tuple[DeterministicFiniteAutomaton, fau.BooleanDecomposition]:
+    """
+    Minimized DFA of the regex and its boolean decomposition, shared between
+    queries through regex_cache; neither must be modified.
+    """
+
+    def compile_regex():
+        dfa = fau.dfa_from_regex(regex)
+        return dfa, fau.BooleanDecomposition.from_fa(dfa)
+
+    return regex_cache.get(regex, compile_regex)
+
+
+def _graph_decomposition(
+    graph: Union[MultiDiGraph, CompiledGraph, fau.BooleanDecomposition],
+    start_nodes: set = None,
+    final_nodes: set = None,
+) -> fau.BooleanDecomposition:
+    if isinstance(graph, fau.BooleanDecomposition):
+        return graph.with_states(_as_states(start_nodes), _as_states(final_nodes))
+    return compile_graph(graph).decomposition(start_nodes, final_nodes)
+
+
+def _automaton_rpq_pairs(
+    query_decomp: fau.BooleanDecomposition,
+    graph: Union[MultiDiGraph, CompiledGraph, fau.BooleanDecomposition],
+    start_states: set = None,
+    final_states: set = None,
+    method: str = "semi_naive",
+) -> IndexPairs:
+    graph_decomp = _graph_decomposition(graph, start_states, final_states)
+
+    intersection = fau.intersect_boolean(graph_decomp, query_decomp)
+    transitive_closure = fau.transitive_closure_boolean(
+        intersection,
+        method=method,
+        sources=np.flatnonzero(intersection.start_mask),
+        targets=np.flatnonzero(intersection.final_mask),
+    )
+
+    # a pair of nodes may be connected from several query states
+    rows, cols = transitive_closure.nonzero()
+    starts, _ = intersection.split_indices(rows)
+    finals, _ = intersection.split_indices(cols)
+    pairs = np.unique(np.stack([starts, finals], axis=1), axis=0)
+
+    return IndexPairs(
+        pairs[:, 0], pairs[:, 1], lambda index: graph_decomp.state_at(index).value
+    )
+
+
+def intersection_rpq_pairs(
+    regex: str,
+    graph: Union[MultiDiGraph, CompiledGraph, fau.BooleanDecomposition],
+    start_states: set = None,
+    final_states: set = None,
+    method: str = "semi_naive",
+) -> IndexPairs:
+    """
+    Same as intersection_rpq, but the answer is streamed rather than built
+    as a set; its indices are those of the graph decomposition states.
+    """
+    _, query_decomp = _compile_regex(regex)
+    return _automaton_rpq_pairs(query_decomp, graph, start_states, final_states, method)
 
 
 def intersection_rpq(
-    regex: str, graph: MultiDiGraph, start_states: set = None, final_states: set = None
+    regex: str,
+    graph: Union[MultiDiGraph, CompiledGraph, fau.BooleanDecomposition],
+    start_states: set = None,
+    final_states: set = None,
+    method: str = "semi_naive",
 ):
-    fa1 = fau.nfa_from_graph(graph, start_states, final_states)
-    fa2 = fau.dfa_from_regex(regex)
+    return intersection_rpq_pairs(
+        regex, graph, start_states, final_states, method
+    ).to_set()
+
+
+def automaton_rpq(
+    query: fau.BooleanDecomposition,
+    graph: Union[MultiDiGraph, CompiledGraph, fau.BooleanDecomposition],
+    start_states: set = None,
+    final_states: set = None,
+    method: str = "semi_naive",
+):
+    """
+    Same as intersection_rpq, but for a query given as the boolean
+    decomposition of an automaton rather than as a regex.
+    """
+    return _automaton_rpq_pairs(
+        query, graph, start_states, final_states, method
+    ).to_set()
+
 
-    intersection = fau.intersect(fa1, fa2)
-    assert not isinstance(list(intersection.states)[0].value, str)
-    transitive_closure = fau.transitive_closure(intersection)
-    states = list(intersection.states)
+def batch_rpq(
+    regexes: List[str],
+    graph: Union[MultiDiGraph, CompiledGraph, fau.BooleanDecomposition],
+    start_states: set = None,
+    final_states: set = None,
+    method: str = "semi_naive",
+) -> List[Set[Tuple]]:
+    """
+    Evaluates every regex as intersection_rpq does, returning the result of
+    the i-th one at index i. The query automata are merged into a disjoint
+    union, so the graph is intersected and closed only once for all of them.
+    """
+    graph_decomp = _graph_decomposition(graph, start_states, final_states)
+    query_decomp, query_ids = fau.disjoint_union_boolean(
+        [_compile_regex(regex)[1] for regex in regexes]
+    )
 
-    result = set()
-    for row, col in zip(*transitive_closure.nonzero()):
-        start_state = states[row]
-        final_state = states[col]
+    intersection = fau.intersect_boolean(graph_decomp, query_decomp)
+    transitive_closure = fau.transitive_closure_boolean(
+        intersection,
+        method=method,
+        sources=np.flatnonzero(intersection.start_mask),
+        targets=np.flatnonzero(intersection.final_mask),
+    )
 
-        if (
-            start_state in intersection.start_states
-            and final_state in intersection.final_states
-        ):
-            start = start_state.value[0]
-            final = final_state.value[0]
-            result.add((start, final))
+    rows, cols = transitive_closure.nonzero()
+    starts, query_states = intersection.split_indices(rows)
+    finals, _ = intersection.split_indices(cols)
 
-    return result
+    results = [set() for _ in regexes]
+    for start, final, query_state in zip(starts, finals, query_states):
+        results[query_ids[query_state]].add(
+            (graph_decomp.state_at(start).value, graph_decomp.state_at(final).value)
+        )
+    return results
+
+
+def _bfs_rpq_values(
+    regex: str,
+    graph: CompiledGraph,
+    start_nodes: set,
+    final_nodes: set = None,
+    separated_start: bool = False,
+    workers: int = None,
+) -> set:
+    # node values rather than states are sent back by worker processes, since
+    # states cache hashes of their values, which differ between processes
+    result = bfs_rpq(regex, graph, start_nodes, final_nodes, separated_start, workers)
+    if separated_start:
+        return {(start.value, final.value) for start, final in result}
+    return {final.value for final in result}
 
 
 def bfs_rpq(
     regex: str,
-    graph: MultiDiGraph,
+    graph: Union[MultiDiGraph, CompiledGraph, fau.BooleanDecomposition],
     start_nodes: set = None,
     final_nodes: set = None,
     separated_start: bool = False,
+    workers: int = None,
+    processes: int = None,
+    shard_size: int = None,
 ):
-    fa = fau.nfa_from_graph(graph, start_nodes, final_nodes)
-    query = fau.dfa_from_regex(regex)
-    return fau.constraint_reachability(fa, query, separated_start)
+    """
+    States of the final nodes reachable from the start nodes by a path in
+    the regex language, or (start, final) pairs of states if separated_start
+    is set; states hold node values.
+
+    With processes set, start nodes are split into shards of shard_size
+    nodes evaluated by that many processes, so that only one shard's front
+    is in memory per process; the graph must not be a decomposition then.
+    """
+    if processes is not None:
+        if isinstance(graph, fau.BooleanDecomposition):
+            raise TypeError("Sharded bfs_rpq needs a graph, not a decomposition")
+        graph = compile_graph(graph)
+        query = partial(
+            _bfs_rpq_values,
+            regex,
+            final_nodes=final_nodes,
+            separated_start=separated_start,
+            workers=workers,
+        )
+        start_nodes = graph.nodes if start_nodes is None else start_nodes
+        result = run_sharded(query, graph, start_nodes, processes, shard_size)
+        if separated_start:
+            return {(State(start), State(final)) for start, final in result}
+        return {State(final) for final in result}
+
+    graph_decomp = _graph_decomposition(graph, start_nodes, final_nodes)
+    _, query_decomp = _compile_regex(regex)
+
+    return fau.constraint_reachability_boolean(
+        graph_decomp, query_decomp, separated_start, workers
+    )
@@ -0,0 +1,47 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, Iterable, List, Set
+import math
+import pickle
+
+from project.cache import dumps
+from project.compiled_graph import CompiledGraph
+
+# compiled graphs already loaded by this process, by the directory they are saved in
+_loaded_graphs: Dict[str, CompiledGraph] = {}
+
+
+def _run_shard(path: str, query: bytes, shard: List[Any]) -> Set:
+    if path not in _loaded_graphs:
+        _loaded_graphs[path] = CompiledGraph.load(path)
+    return pickle.loads(query)(_loaded_graphs[path], shard)
+
+
+def run_sharded(
+    query: Callable[[CompiledGraph, List[Any]], Set],
+    graph: CompiledGraph,
+    start_nodes: Iterable[Any],
+    processes: int,
+    shard_size: int = None,
+) -> Set:
+    """
+    Splits start_nodes into shards of shard_size nodes, evaluates
+    query(graph, shard) for every shard in a pool of processes and merges
+    the results. The graph is saved once into a temporary directory and
+    memory-mapped by the workers instead of being pickled for every shard,
+    so its nodes and labels must be JSON serializable. The query must be
+    picklable, e.g. a module-level function or a partial of one.
+    """
+    start_nodes = list(start_nodes)
+    if shard_size is None:
+        shard_size = max(1, math.ceil(len(start_nodes) / (4 * processes)))
+    shards = [
+        start_nodes[i : i + shard_size] for i in range(0, len(start_nodes), shard_size)
+    ]
+
+    with TemporaryDirectory() as path:
+        graph.save(path)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = executor.map(partial(_run_shard, path, dumps(query)), shards)
+            return set().union(*results)
@@ -1,5 +1,8 @@
 import cfpq_data
+import pytest
 
+import project.automata_utils as au
+import project.matrix_backend as mb
 from project.automata_utils import *
 
 
@@ -17,6 +20,7 @@ def test_nfa_from_graph_with_no_starting_nodes():
 
     nfa = nfa_from_graph(graph, final_nodes=final_nodes)
 
+    assert isinstance(nfa, NondeterministicFiniteAutomaton)
     assert nfa.start_states == set(graph)
     assert nfa.final_states == final_nodes
 
@@ -95,3 +99,236 @@ def test_transitive_closure():
     assert not tc[0, 3]
     assert not tc[1, 3]
     assert not tc[2, 3]
+
+
+def test_boolean_decomposition_from_graph():
+    graph = cfpq_data.labeled_two_cycles_graph(2, 3, labels=("a", "b"))
+
+    decomposition = BooleanDecomposition.from_graph(graph, {0}, {3})
+
+    assert decomposition.labels == {"a", "b"}
+    assert decomposition.start_states == {0}
+    assert decomposition.final_states == {3}
+    assert decomposition["a"].nnz + decomposition["b"].nnz == graph.number_of_edges()
+    for source, destination, label in graph.edges(data="label"):
+        source_ind = decomposition.index_of(State(source))
+        destination_ind = decomposition.index_of(State(destination))
+        assert decomposition[label][source_ind, destination_ind]
+
+
+def test_boolean_decomposition_from_graph_is_equivalent_to_nfa():
+    graph = cfpq_data.labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+
+    decomposition = BooleanDecomposition.from_graph(graph, {0, 1}, {2})
+    nfa = nfa_from_graph(graph.copy(), {0, 1}, {2})
+
+    assert nfa.is_equivalent_to(decomposition.compose())
+
+
+def test_adjacency_matrix():
+    fa = NondeterministicFiniteAutomaton()
+    fa.add_transitions([(0, "a", 1), (0, "b", 1), (1, "a", 2)])
+    states = list(fa.states)
+
+    adj = adjacency_matrix(fa)
+
+    assert adj.nnz == 2
+    assert adj[states.index(0), states.index(1)]
+    assert adj[states.index(1), states.index(2)]
+
+
+def test_intersect_boolean_product_states():
+    fa1 = BooleanDecomposition.from_fa(dfa_from_regex("a.b*"))
+    fa2 = BooleanDecomposition.from_fa(dfa_from_regex("a*.b"))
+
+    intersection = intersect_boolean(fa1, fa2)
+
+    assert intersection.states_count == fa1.states_count * fa2.states_count
+    for state1 in fa1.states:
+        for state2 in fa2.states:
+            state = State((state1.value, state2.value))
+            index = intersection.index_of(state)
+            assert intersection.state_at(index) == state
+            assert intersection.start_mask[index] == (
+                state1 in fa1.start_states and state2 in fa2.start_states
+            )
+            assert intersection.final_mask[index] == (
+                state1 in fa1.final_states and state2 in fa2.final_states
+            )
+    assert intersection.start_states == {
+        State((state1.value, state2.value))
+        for state1 in fa1.start_states
+        for state2 in fa2.start_states
+    }
+
+
+@pytest.mark.parametrize("backend", [None, "sparse", "bitset"])
+def test_transitive_closure_reports_progress(backend):
+    fa = NondeterministicFiniteAutomaton()
+    fa.add_transitions([(0, "a", 1), (1, "a", 2), (2, "a", 3)])
+    progress = []
+
+    tc = transitive_closure(fa, lambda *args: progress.append(args), backend=backend)
+
+    assert tc.nnz == 6
+    assert progress == [(1, 2, 5), (2, 1, 6), (3, 0, 6)]
+
+
+def test_scc_transitive_closure_matches_semi_naive():
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    graph.add_edges_from([(9, 10, {"label": "a"}), (10, 11, {"label": "b"})])
+    decomp = BooleanDecomposition.from_graph(graph)
+
+    expected = transitive_closure_boolean(decomp, method="semi_naive")
+    actual = transitive_closure_boolean(decomp, method="scc")
+
+    assert (expected != actual).nnz == 0
+
+
+def test_scc_transitive_closure_restricted():
+    fa = NondeterministicFiniteAutomaton()
+    fa.add_transitions([(0, "a", 1), (1, "a", 2), (2, "a", 0), (3, "a", 2)])
+    decomp = BooleanDecomposition.from_fa(fa)
+    sources = [decomp.index_of(State(3))]
+    targets = [decomp.index_of(State(0)), decomp.index_of(State(3))]
+
+    tc = transitive_closure_boolean(
+        decomp, method="scc", sources=sources, targets=targets
+    )
+
+    assert tc.nnz == 1
+    assert tc[sources[0], targets[0]]
+
+
+def test_transitive_closure_from_sources():
+    fa = NondeterministicFiniteAutomaton()
+    fa.add_transitions([(0, "a", 1), (1, "a", 2), (2, "a", 3), (4, "a", 0)])
+    decomp = BooleanDecomposition.from_fa(fa)
+    progress = []
+
+    tc = transitive_closure_boolean(
+        decomp,
+        lambda *args: progress.append(args),
+        sources=[decomp.index_of(State(1))],
+    )
+
+    assert tc.nnz == 2
+    assert tc[decomp.index_of(State(1)), decomp.index_of(State(2))]
+    assert tc[decomp.index_of(State(1)), decomp.index_of(State(3))]
+    assert progress[-1][2] == 2
+
+
+def test_nfa_from_graph_does_not_modify_graph():
+    graph = cfpq_data.labeled_two_cycles_graph(2, 3)
+    expected = graph.copy()
+
+    nfa_from_graph(graph, {0}, {1})
+
+    assert dict(graph.nodes(data=True)) == dict(expected.nodes(data=True))
+
+
+def test_boolean_decomposition_with_states_shares_matrices():
+    graph = cfpq_data.labeled_two_cycles_graph(2, 3, labels=("a", "b"))
+    decomp = BooleanDecomposition.from_graph(graph)
+
+    view = decomp.with_states({State(0)}, {State(1)})
+
+    assert view["a"] is decomp["a"]
+    assert view.states is decomp.states
+    assert view.start_states == {0}
+    assert view.final_states == {1}
+    assert decomp.start_states == set(graph.nodes)
+
+
+def test_extend_transitive_closure():
+    fa = NondeterministicFiniteAutomaton()
+    fa.add_transitions([(0, "a", 1), (1, "a", 2), (3, "a", 4), (4, "a", 0)])
+    full_fa = fa.copy()
+    full_fa.add_transitions([(2, "a", 3), (2, "a", 5)])
+    states = list(full_fa.states)
+    closure = transitive_closure(full_fa)
+    added = np.zeros(closure.shape, dtype=bool)
+    added[states.index(2), states.index(3)] = True
+    added[states.index(2), states.index(5)] = True
+    base = adjacency_matrix(full_fa).toarray() & ~added
+    base_closure = transitive_closure_boolean(
+        BooleanDecomposition({}, {"a": sparse.csr_matrix(base)}, states, set(), set())
+    )
+
+    extended, new_pairs = extend_transitive_closure(
+        base_closure, sparse.csr_matrix(added)
+    )
+
+    assert (extended != closure).nnz == 0
+    assert (new_pairs != (closure > base_closure)).nnz == 0
+
+
+def test_disjoint_union_boolean():
+    fa1 = BooleanDecomposition.from_fa(dfa_from_regex("a.b"))
+    fa2 = BooleanDecomposition.from_fa(dfa_from_regex("b*"))
+
+    union, tags = disjoint_union_boolean([fa1, fa2])
+    nfa = union.compose()
+
+    assert list(tags) == [0] * fa1.states_count + [1] * fa2.states_count
+    assert all(nfa.accepts(word) for word in ["ab", "", "bbb"])
+    assert not any(nfa.accepts(word) for word in ["abb", "a", "ba"])
+
+
+def test_constraint_reachability_separated_start():
+    # every start state is searched from on its own and reported by itself,
+    # not by the number of its block of the front
+    fa = NondeterministicFiniteAutomaton()
+    fa.add_transitions([("x", "a", "y"), ("z", "b", "w"), ("y", "b", "w")])
+    for state in ("x", "z"):
+        fa.add_start_state(State(state))
+    for state in ("y", "w"):
+        fa.add_final_state(State(state))
+
+    assert constraint_reachability(fa, dfa_from_regex("a"), True) == {
+        (State("x"), State("y"))
+    }
+    assert constraint_reachability(fa, dfa_from_regex("b*"), True) == {
+        (State("z"), State("w"))
+    }
+
+
+@pytest.mark.parametrize("separated_start", [False, True])
+def test_constraint_reachability_backends(separated_start):
+    graph = cfpq_data.labeled_two_cycles_graph(40, 30, labels=("a", "b"))
+    fa = nfa_from_graph(graph, {0, 5, 45}, {1, 2, 3, 50})
+    constraint = dfa_from_regex("a*.b.(b.b)*")
+
+    results = [
+        constraint_reachability(fa, constraint, separated_start, backend=backend)
+        for backend in ("sparse", "bitset")
+    ]
+
+    assert results[0] == results[1]
+    assert len(results[0]) != 0
+
+
+def test_constraint_reachability_pairs():
+    graph = cfpq_data.labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    fa = BooleanDecomposition.from_graph(graph, {0, 1})
+    constraint = BooleanDecomposition.from_fa(dfa_from_regex("a*.b"))
+
+    pairs = constraint_reachability_pairs(fa, constraint)
+
+    assert set(pairs) == constraint_reachability_boolean(fa, constraint, True)
+    assert len(pairs) == len(set(pairs))
+    assert {fa.state_at(final) for final in pairs.finals} == (
+        constraint_reachability_boolean(fa, constraint)
+    )
+
+
+def test_front_backend_follows_front_size(monkeypatch):
+    graph = cfpq_data.labeled_two_cycles_graph(9, 10, labels=("a", "b"))
+    fa = BooleanDecomposition.from_graph(graph)
+    monkeypatch.setattr(mb, "BITSET_MAX_CELLS", 1000)
+    monkeypatch.setattr(mb, "BITSET_MIN_DENSITY", 0.001)
+
+    assert fa.backend is mb.BitsetBackend
+    assert au._front_backend(fa, 2) is mb.BitsetBackend
+    assert au._front_backend(fa, 60) is mb.SparseBackend
+    assert au._front_backend(fa, 60, "bitset") is mb.BitsetBackend
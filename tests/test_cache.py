@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+from pyformlang.cfg import CFG
+
+from project.cache import LruCache, cfg_fingerprint
+import project.cfpq as cfpq
+from project.cfpq import Productions
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LruCache(max_size=2)
+
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 3)
+    cache.get("c", lambda: 4)
+
+    assert cache.get("a", lambda: 5) == 1
+    assert cache.get("b", lambda: 6) == 6
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.size) == (2, 4, 2)
+
+
+def test_cfg_fingerprint_ignores_productions_order():
+    cfg1 = CFG.from_text("S -> a S b | $\nA -> a")
+    cfg2 = CFG.from_text("A -> a\nS -> $ | a S b")
+    cfg3 = CFG.from_text("S -> a S b | $\nA -> b")
+
+    assert cfg_fingerprint(cfg1) == cfg_fingerprint(cfg2)
+    assert cfg_fingerprint(cfg1) != cfg_fingerprint(cfg3)
+
+
+def test_lru_cache_persists_to_disk(tmp_path):
+    cfg = CFG.from_text("S -> a S b | $")
+    key = cfg_fingerprint(cfg)
+    LruCache(path=str(tmp_path)).get(key, lambda: Productions(cfg))
+
+    script = f"""
+from pyformlang.cfg import Variable
+from project.cache import LruCache
+cache = LruCache(path={str(tmp_path)!r})
+prods = cache.get({key!r}, lambda: None)
+assert cache.stats.misses == 1 and prods is not None
+assert Variable("S") in prods.wcnf.variables
+"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(
+        [sys.executable, "-c", script],
+        check=True,
+        cwd=root,
+        env={**os.environ, "PYTHONHASHSEED": "1", "PYTHONPATH": root},
+    )
+
+
+def test_grammar_cache_path(tmp_path):
+    cfg = CFG.from_text("S -> a S b | $")
+    try:
+        cfpq.set_grammar_cache_path(str(tmp_path))
+        cfpq._productions(cfg)
+
+        assert (tmp_path / f"wcnf-{cfg_fingerprint(cfg)}.pickle").exists()
+    finally:
+        cfpq.set_grammar_cache_path(None)
@@ -1,8 +1,19 @@
 import itertools
 import pytest
 import networkx as nx
+import cfpq_data
+import numpy as np
+from pyformlang.cfg import CFG
 
-from project.cfpq import cfpq
+from project.cfpq import (
+    cfpq,
+    cfpq_pairs,
+    multi_source_cfpq,
+    _matrix_cfpq,
+    _reachable,
+    _triples,
+)
+from project.compiled_graph import compile_graph
 from project.cfg_utils import from_file
 
 
@@ -10,7 +21,7 @@ resource_path = "tests/resources/cfg/path_query"
 
 graphs = ["bamboo", "empty", "two_cycles"]
 cfgs = ["aba_star", "bbs", "empty", "epsilon"]
-algos = ["hellings", "matrix", "tensor"]
+algos = ["hellings", "matrix", "tensor", "gll"]
 
 expected_results = {
     ("bamboo", "aba_star"): {("0", "3"), ("0", "2")},
@@ -49,3 +60,123 @@ def test_cfpq(graph_name, cfg_name, algo):
     result = cfpq(cfg, graph, algorithm=algo)
 
     assert result == expected_results[(graph_name, cfg_name)]
+
+
+@pytest.mark.parametrize("algo", algos)
+def test_cfpq_on_two_cycles(algo):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    cfg = CFG.from_text("S -> a S b | a b")
+
+    result = cfpq(cfg, graph, algorithm=algo, start_nodes={0, 1, 2})
+
+    assert result == {
+        (0, 0),
+        (0, 5),
+        (0, 6),
+        (0, 7),
+        (1, 0),
+        (1, 5),
+        (1, 6),
+        (1, 7),
+        (2, 0),
+        (2, 5),
+        (2, 6),
+        (2, 7),
+    }
+
+
+def test_matrix_cfpq_backends():
+    graph = compile_graph(cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b")))
+    cfg = CFG.from_text("S -> a S b | a b | $")
+
+    assert _triples(graph, _matrix_cfpq(cfg, graph, "bitset")) == _triples(
+        graph, _matrix_cfpq(cfg, graph, "sparse")
+    )
+
+
+@pytest.mark.parametrize("algo", algos)
+def test_cfpq_pairs(algo):
+    graph = compile_graph(cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b")))
+    cfg = CFG.from_text("S -> a S b | a b")
+
+    pairs = cfpq_pairs(cfg, graph, algo, start_nodes={0, 1, 2}, final_nodes={5, 6})
+    chunks = list(pairs.chunks(size=4))
+
+    assert len(pairs) == 6
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert set(sum(chunks, [])) == cfpq(cfg, graph, algo, {0, 1, 2}, {5, 6})
+    assert {
+        (graph.node_at(start), graph.node_at(final))
+        for start, final in zip(pairs.starts, pairs.finals)
+    } == {(start, final) for start in (0, 1, 2) for final in (5, 6)}
+
+
+@pytest.mark.parametrize(
+    "graph_name, cfg_name, algo",
+    itertools.product(graphs, cfgs, ["matrix", "gll"]),
+)
+def test_multi_source_cfpq(graph_name, cfg_name, algo):
+    graph = nx.drawing.nx_agraph.read_dot(f"{resource_path}/graphs/{graph_name}.dot")
+    cfg = from_file(f"{resource_path}/cfgs/{cfg_name}.cfg")
+
+    result = multi_source_cfpq(cfg, graph, separated_start=True, algorithm=algo)
+
+    assert result == expected_results[(graph_name, cfg_name)]
+
+
+@pytest.mark.parametrize("algo", ["matrix", "gll"])
+def test_multi_source_cfpq_from_start_nodes(algo):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    cfg = CFG.from_text("S -> a S b | a b")
+
+    separated = multi_source_cfpq(
+        cfg, graph, {1, 3}, {0, 6}, separated_start=True, algorithm=algo
+    )
+    finals = multi_source_cfpq(cfg, graph, {1, 3}, {0, 6}, algorithm=algo)
+
+    assert separated == cfpq(cfg, graph, "hellings", {1, 3}, {0, 6})
+    assert finals == {final for _, final in separated}
+
+
+@pytest.mark.parametrize("algo", ["matrix", "gll"])
+def test_multi_source_cfpq_empty_node_sets(algo):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    cfg = CFG.from_text("S -> a S b | a b")
+
+    assert multi_source_cfpq(cfg, graph, set(), algorithm=algo) == set()
+    assert multi_source_cfpq(cfg, graph, {0}, set(), algorithm=algo) == set()
+    assert multi_source_cfpq(cfg, graph, set(), algorithm=algo, processes=2) == set()
+
+
+def test_multi_source_cfpq_skips_unreachable_nodes():
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    graph.add_edges_from((i, i + 1, {"label": "a"}) for i in range(100, 110))
+    compiled = compile_graph(graph)
+    cfg = CFG.from_text("S -> a S b | a b")
+
+    reachable = _reachable(compiled, np.array([compiled.index_of(1)]))
+
+    assert {compiled.node_at(node) for node in reachable} == set(range(8))
+    assert multi_source_cfpq(
+        cfg, compiled, {1}, separated_start=True, algorithm="matrix"
+    ) == cfpq(cfg, graph, "hellings", {1})
+
+
+@pytest.mark.parametrize("algo", ["tensor", "nope"])
+def test_multi_source_cfpq_unknown_algorithm(algo):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+
+    with pytest.raises(ValueError):
+        multi_source_cfpq(CFG.from_text("S -> a b"), graph, {0}, algorithm=algo)
+
+
+@pytest.mark.parametrize("algo", ["matrix", "gll"])
+def test_sharded_multi_source_cfpq(algo):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    cfg = CFG.from_text("S -> a S b | a b")
+
+    result = multi_source_cfpq(
+        cfg, graph, {0, 1, 2, 3}, algorithm=algo, processes=2, shard_size=1
+    )
+
+    assert result == multi_source_cfpq(cfg, graph, {0, 1, 2, 3}, algorithm=algo)
@@ -0,0 +1,106 @@
+import cfpq_data
+import pytest
+from networkx import MultiDiGraph
+from pyformlang.cfg import CFG
+from pyformlang.finite_automaton import Symbol
+
+from project.cfpq import cfpq
+from project.compiled_graph import CompiledGraph
+from project.rpq import intersection_rpq, bfs_rpq
+
+
+def test_from_graph():
+    graph = cfpq_data.labeled_two_cycles_graph(2, 3, labels=("a", "b"))
+
+    compiled = CompiledGraph.from_graph(graph)
+
+    assert compiled.number_of_nodes == graph.number_of_nodes()
+    assert set(compiled.labels) == {"a", "b"}
+    assert sorted(compiled.edges()) == sorted(graph.edges(data="label"))
+
+
+def test_add_edges():
+    compiled = CompiledGraph([0, 1])
+    compiled.add_edges([(0, 1, "a")])
+
+    compiled.add_edges([(1, 2, "a"), (2, 0, "b"), (0, 1, "a")])
+
+    assert compiled.nodes == [0, 1, 2]
+    assert compiled["a"].shape == (3, 3)
+    assert sorted(compiled.edges()) == [(0, 1, "a"), (1, 2, "a"), (2, 0, "b")]
+
+
+def test_remove_edges():
+    compiled = CompiledGraph()
+    compiled.add_edges([(0, 1, "a"), (1, 2, "a"), (2, 0, "b")])
+
+    compiled.remove_edges([(1, 2, "a"), (2, 0, "b"), (5, 0, "b"), (0, 1, "c")])
+
+    assert list(compiled.edges()) == [(0, 1, "a")]
+    assert set(compiled.labels) == {"a"}
+    assert compiled.nodes == [0, 1, 2]
+
+
+@pytest.mark.parametrize("algorithm", ["hellings", "matrix", "tensor"])
+def test_queries_on_compiled_graph(algorithm):
+    graph = cfpq_data.labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    compiled = CompiledGraph.from_graph(graph)
+    cfg = CFG.from_text("S -> a S b | a b")
+    regex = "a*.b"
+
+    assert cfpq(cfg, compiled, algorithm) == cfpq(cfg, graph, algorithm)
+    assert intersection_rpq(regex, compiled, {0}) == intersection_rpq(regex, graph, {0})
+    assert bfs_rpq(regex, compiled, {0, 1}, None, True) == bfs_rpq(
+        regex, graph, {0, 1}, None, True
+    )
+
+
+def test_queries_after_update():
+    graph = MultiDiGraph()
+    graph.add_edges_from([(0, 1, {"label": "a"}), (1, 2, {"label": "b"})])
+    compiled = CompiledGraph.from_graph(graph)
+    assert intersection_rpq("a.b", compiled) == {(0, 2)}
+
+    compiled.add_edges([(2, 3, "a"), (3, 4, "b")])
+    assert intersection_rpq("a.b", compiled) == {(0, 2), (2, 4)}
+
+    compiled.remove_edges([(0, 1, "a")])
+    assert intersection_rpq("a.b", compiled) == {(2, 4)}
+
+
+def test_decomposition_is_a_snapshot():
+    graph = MultiDiGraph()
+    graph.add_edges_from([(0, 1, {"label": "a"}), (1, 2, {"label": "b"})])
+    compiled = CompiledGraph.from_graph(graph)
+    decomp = compiled.decomposition()
+
+    compiled.add_edges([(2, 3, "a"), (3, 4, "b")])
+    compiled.add_nodes([5])
+
+    assert decomp.states_count == 3
+    assert decomp[Symbol("a")].shape == (3, 3)
+    assert intersection_rpq("a.b", decomp) == {(0, 2)}
+
+
+def test_save_and_load(tmp_path):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    compiled = CompiledGraph.from_graph(graph)
+
+    compiled.save(str(tmp_path))
+    loaded = CompiledGraph.load(str(tmp_path))
+
+    assert loaded.nodes == compiled.nodes
+    assert sorted(loaded.edges()) == sorted(compiled.edges())
+    assert intersection_rpq("a*.b", loaded, {0}) == intersection_rpq("a*.b", graph, {0})
+
+
+def test_loaded_graph_can_be_updated(tmp_path):
+    compiled = CompiledGraph()
+    compiled.add_edges([(0, 1, "a"), (1, 2, "b")])
+    compiled.save(str(tmp_path))
+
+    loaded = CompiledGraph.load(str(tmp_path))
+    loaded.add_edges([(2, 3, "a")])
+    loaded.remove_edges([(0, 1, "a")])
+
+    assert sorted(loaded.edges()) == [(1, 2, "b"), (2, 3, "a")]
@@ -0,0 +1,40 @@
+import itertools
+import pytest
+from pyformlang.cfg import CFG
+
+from project.cyk import CykRecognizer, cyk
+
+grammars = [
+    "S -> a S b | a b",
+    "S -> S S | a | $",
+    "S -> a S b S | $",
+    "S -> A B C\nA -> a | $\nB -> $ | b B\nC -> c | $",
+]
+
+
+@pytest.mark.parametrize("text", grammars)
+def test_cyk_matches_cfg_contains(text):
+    cfg = CFG.from_text(text)
+    recognizer = CykRecognizer(cfg)
+
+    for length in range(6):
+        for word in itertools.product("abc", repeat=length):
+            assert recognizer.recognize(word) == cfg.contains(word)
+
+
+def test_cyk():
+    cfg = CFG.from_text("S -> a S b | a b")
+
+    assert cyk(cfg, "aabb")
+    assert cyk(cfg, ["a", "b"])
+    assert not cyk(cfg, "")
+    assert not cyk(cfg, "abab")
+
+
+def test_recognize_all_in_process_pool():
+    recognizer = CykRecognizer(CFG.from_text("S -> a S b S | $"))
+    words = ["".join(word) for word in itertools.product("ab", repeat=6)]
+
+    assert recognizer.recognize_all(words, processes=2) == recognizer.recognize_all(
+        words
+    )
@@ -0,0 +1,65 @@
+import io
+import pytest
+import cfpq_data
+
+from project.graph_query_lang.interpreter import Interpreter
+from project.graph_query_lang.plans import GraphPlan
+
+
+def run(text: str, **env) -> str:
+    out = io.StringIO()
+    interpreter = Interpreter(out)
+    interpreter.env.update(env)
+    interpreter.run(text)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize(
+    "program, expected",
+    [
+        ("print 1", "1"),
+        ("print -2", "-2"),
+        ("print not false", "true"),
+        ("print true && false", "false"),
+        ("print 2 in [1, 2]", "true"),
+        ("print [1..3]", "[1, 2, 3]"),
+        ("print [3, 1, 2] |> filter (\\x -> x in [1, 2])", "[1, 2]"),
+        ("print map (\\x -> -x) ([1, 2])", "[-2, -1]"),
+        ('print {"a"}*', '{"(a)*"}'),
+        ("let x = 1\nlet y = x\nlet x = 2\nprint y", "1"),
+    ],
+)
+def test_values(program, expected):
+    assert run(program) == f"{expected}\n"
+
+
+def test_graph_pipeline():
+    # string literals cannot hold paths, so the graph is bound beforehand
+    graph = GraphPlan.from_graph(
+        cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    )
+    program = """
+let h = g |> set_start [0] |> set_final [1..2]
+print get_start h
+print get_reachable h
+print h & {"a*"}
+print set_start [0, 1, 2] (g) & {|S -> a S b | a b|}
+"""
+
+    assert run(program, g=graph).splitlines() == [
+        "[0]",
+        "[(0, 1), (0, 2)]",
+        "[(0, 1), (0, 2)]",
+        "[(0, 0), (0, 5), (0, 6), (0, 7), (1, 0), (1, 5), (1, 6), (1, 7), "
+        "(2, 0), (2, 5), (2, 6), (2, 7)]",
+    ]
+
+
+def test_graph_is_loaded_lazily():
+    # binding a pipeline over a missing dataset must not load it
+    run('let g = load "missing_dataset" |> set_start [0]')
+
+
+def test_syntax_error():
+    with pytest.raises(ValueError):
+        run("let = 1")
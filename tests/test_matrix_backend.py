@@ -0,0 +1,148 @@
+import cfpq_data
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from pyformlang.cfg import CFG
+from scipy import sparse
+
+import project.automata_utils as au
+from project.cfpq import _matrix_cfpq, _tensor_cfpq, multi_source_cfpq
+from project.compiled_graph import compile_graph
+from project.matrix_backend import *
+
+
+def random_matrix(shape, density, seed):
+    return sparse.random(*shape, density, format="csr", random_state=seed, dtype=bool)
+
+
+@pytest.mark.parametrize(
+    "n, k, m", [(1, 1, 1), (5, 70, 3), (64, 64, 64), (90, 130, 65)]
+)
+def test_bit_matrix_operations(n, k, m):
+    a = random_matrix((n, k), 0.3, 0)
+    b = random_matrix((k, m), 0.3, 1)
+    c = random_matrix((n, m), 0.3, 2)
+    bit_a, bit_b, bit_c = (BitMatrix.from_csr(matrix) for matrix in (a, b, c))
+
+    assert ((bit_a @ bit_b).tocsr() != a @ b).nnz == 0
+    assert ((bit_c + bit_a @ bit_b).tocsr() != c + a @ b).nnz == 0
+    assert ((bit_c > bit_a @ bit_b).tocsr() != (c > a @ b)).nnz == 0
+    assert bit_c.nnz == c.nnz
+    assert bit_c.shape == (n, m)
+
+
+@pytest.mark.parametrize("backend", backends.values())
+def test_move_rows(backend):
+    matrix = backend.from_csr(sparse.csr_matrix(np.eye(3, dtype=bool)))
+
+    moved = backend.move_rows(matrix, [0, 1, 2], [1, 1, 0], 2)
+
+    assert (backend.to_csr(moved).toarray() == [[0, 0, 1], [1, 1, 0]]).all()
+    assert list(backend.nonempty_rows(moved)) == [0, 1]
+
+
+@pytest.mark.parametrize("backend", backends.values())
+def test_union(backend):
+    matrices = [random_matrix((6, 9), 0.3, seed) for seed in range(3)]
+
+    union = backend.union([backend.from_csr(matrix) for matrix in matrices], (6, 9))
+
+    expected = sum(matrix.toarray() for matrix in matrices) > 0
+    assert (backend.to_csr(union).toarray() == expected).all()
+    assert backend.to_csr(backend.union([], (6, 9))).nnz == 0
+
+
+def test_choose_backend():
+    assert choose_backend((100, 100), 1000) is BitsetBackend
+    assert choose_backend((100, 100), 10) is SparseBackend
+    assert choose_backend((100, 100), 1000, "sparse") is SparseBackend
+    assert choose_backend((0, 0), 0) is SparseBackend
+
+
+def test_csr_helpers_match_scipy():
+    a = random_matrix((7, 5), 0.4, 3)
+    b = random_matrix((3, 4), 0.4, 4)
+    rows, cols = csr_nonzero(a)
+
+    assert (csr_from_coords(rows, cols, a.shape) != a).nnz == 0
+    b_rows, b_cols = csr_nonzero(b)
+    keys = np.tile(b_rows * b.shape[1] + b_cols, 2)[::-1]
+    assert (csr_from_keys(keys, b.shape) != b).nnz == 0
+    assert csr_from_keys(keys, b.shape).has_sorted_indices
+    assert (csr_diagonal(np.array([True, False, True])).diagonal() == [1, 0, 1]).all()
+
+
+def test_count_conversions():
+    matrix = sparse.csr_matrix(np.eye(3, dtype=bool))
+    original = sparse.csr_matrix.tocoo
+
+    with count_conversions() as conversions:
+        matrix.tocoo()
+        matrix.tocsr()
+        BitsetBackend.to_csr(BitsetBackend.from_csr(matrix))
+
+    assert conversions == {
+        ("csr", "coo"): 1,
+        ("csr", "bitset"): 1,
+        ("bitset", "csr"): 1,
+    }
+    assert sparse.csr_matrix.tocoo is original
+
+
+def test_count_conversions_blocks_from_threads():
+    matrix = sparse.csr_matrix(np.eye(3, dtype=bool))
+    original = sparse.csr_matrix.tocoo
+
+    def convert(_):
+        with count_conversions() as conversions:
+            matrix.tocoo()
+        return conversions[("csr", "coo")]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        counts = list(executor.map(convert, range(32)))
+
+    assert all(count >= 1 for count in counts)
+    assert sparse.csr_matrix.tocoo is original
+
+
+cfg = CFG.from_text("S -> a S b | a b")
+
+
+@pytest.mark.parametrize(
+    "run",
+    [
+        lambda graph: _matrix_cfpq(cfg, graph, "sparse"),
+        lambda graph: _matrix_cfpq(cfg, graph, "bitset"),
+        lambda graph: _tensor_cfpq(cfg, graph),
+        lambda graph: multi_source_cfpq(cfg, graph, {0}, algorithm="matrix"),
+        lambda graph: au.transitive_closure_boolean(
+            graph.decomposition(), backend="sparse"
+        ),
+        lambda graph: au.transitive_closure_boolean(
+            graph.decomposition(), backend="bitset"
+        ),
+        lambda graph: au.constraint_reachability_boolean(
+            graph.decomposition({0}),
+            au.BooleanDecomposition.from_fa(au.dfa_from_regex("a*.b*")),
+            backend="sparse",
+        ),
+        lambda graph: au.constraint_reachability_boolean(
+            graph.decomposition({0}),
+            au.BooleanDecomposition.from_fa(au.dfa_from_regex("a*.b*")),
+            backend="bitset",
+        ),
+    ],
+)
+def test_no_conversions_in_fixpoint_loops(run):
+    # grammars and regexes are compiled and cached by the first run
+    run(compile_graph(cfpq_data.labeled_two_cycles_graph(2, 2, labels=("a", "b"))))
+    counts = []
+    for n in (60, 120):
+        graph = compile_graph(
+            cfpq_data.labeled_two_cycles_graph(n, n, labels=("a", "b"))
+        )
+        with count_conversions() as conversions:
+            run(graph)
+        counts.append(conversions)
+
+    assert counts[0] == counts[1]
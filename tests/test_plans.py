@@ -0,0 +1,86 @@
+import cfpq_data
+import pytest
+from pyformlang.cfg import CFG
+
+from project.cfpq import cfpq
+from project.compiled_graph import CompiledGraph
+from project.graph_query_lang import plans
+from project.graph_query_lang.plans import GraphPlan, Lazy, RegexPlan, force
+from project.rpq import intersection_rpq
+
+
+@pytest.fixture
+def graph():
+    return cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+
+
+def test_pipeline_is_lazy_and_shares_graph(graph):
+    loads = []
+
+    def load():
+        loads.append(1)
+        return CompiledGraph.from_graph(graph)
+
+    plan = GraphPlan(Lazy(load)).set_start({0}).add_final({1, 2})
+    other = plan.set_final({3})
+    query = plans.intersect(plan, RegexPlan("a*"))
+
+    assert loads == []
+    assert force(query) == {(0, 0), (0, 1), (0, 2), (0, 3), (0, 4)}
+    assert other.get_final() == {3}
+    assert loads == [1]
+
+
+def test_graph_accessors(graph):
+    plan = GraphPlan.from_graph(graph).set_start({0}).set_final({0, 1})
+
+    assert plan.get_vertices() == set(range(8))
+    assert plan.get_labels() == {"a", "b"}
+    assert (0, "a", 1) in plan.get_edges()
+    assert plan.get_start() == {0}
+    assert plan.add_start({5}).get_start() == {0, 5}
+    assert plan.get_reachable() == {(0, 0), (0, 1)}
+
+
+def test_regex_query(graph):
+    regex = plans.concat(plans.star("a"), plans.union("b", "a"))
+    plan = GraphPlan.from_graph(graph).set_start({0, 5})
+
+    assert force(plans.intersect(regex, plan)) == intersection_rpq(
+        "(a)*.(b|a)", graph, {0, 5}
+    )
+
+
+def test_automaton_query(graph):
+    automaton = plans.intersect(RegexPlan("a*"), RegexPlan("a.a*"))
+    plan = GraphPlan.from_graph(graph).set_start({0})
+
+    assert force(plans.intersect(plan, automaton)) == intersection_rpq(
+        "a.a*", graph, {0}
+    )
+    assert force(plans.intersect(plan, plans.concat(automaton, "b"))) == {(0, 5)}
+
+
+def test_cfg_query(graph):
+    cfg = plans.cfg_from_text("S -> a S b | a b")
+    plan = GraphPlan.from_graph(graph).set_start({0, 1, 2})
+    expected = cfpq(CFG.from_text("S -> a S b | a b"), graph, "hellings", {0, 1, 2})
+
+    assert force(plans.intersect(plan, cfg)) == expected
+    assert force(plans.intersect(plan, plans.intersect(cfg, "(a|b)*"))) == expected
+    assert force(plans.intersect(plan, plans.star(cfg))) == expected | {
+        (start, start) for start in (0, 1, 2)
+    }
+
+
+def test_empty_start_set(graph):
+    plan = GraphPlan.from_graph(graph).set_start(set())
+
+    assert force(plans.intersect(plan, plans.cfg_from_text("S -> a b"))) == set()
+
+
+def test_unsupported_operation(graph):
+    cfg = plans.cfg_from_text("S -> a S b | a b")
+
+    with pytest.raises(ValueError):
+        plans.intersect(cfg, cfg)
@@ -1,10 +1,13 @@
 import cfpq_data
+import pytest
 from pyformlang.finite_automaton import NondeterministicFiniteAutomaton, State, Symbol
 
+from project.automata_utils import BooleanDecomposition, dfa_from_regex
 from project.rpq import *
 
 
-def test_rpq1():
+@pytest.mark.parametrize("method", ["semi_naive", "scc"])
+def test_rpq1(method):
     automaton = NondeterministicFiniteAutomaton()
     automaton.add_transition(State(0), Symbol("a"), State(1))
     automaton.add_transition(State(1), Symbol("b"), State(2))
@@ -12,17 +15,19 @@ def test_rpq1():
     automaton.add_transition(State(3), Symbol("c"), State(4))
     graph = automaton.to_networkx()
 
-    assert intersection_rpq("(a|f).(b|d)", graph, {0}, {2, 4}) == {(0, 2)}
+    assert intersection_rpq("(a|f).(b|d)", graph, {0}, {2, 4}, method) == {(0, 2)}
 
 
-def test_rpq2():
+@pytest.mark.parametrize("method", ["semi_naive", "scc"])
+def test_rpq2(method):
     graph = cfpq_data.labeled_two_cycles_graph(3, 3, labels=("a", "b"), common_node=0)
     regex = "(a|b)(aa)*"
 
-    assert intersection_rpq(regex, graph, {0}, {1}) == {(0, 1)}
+    assert intersection_rpq(regex, graph, {0}, {1}, method) == {(0, 1)}
 
 
-def test_rpq_reachability():
+@pytest.mark.parametrize("method", ["semi_naive", "scc"])
+def test_rpq_reachability(method):
     automaton = NondeterministicFiniteAutomaton()
     automaton.add_transition(State(0), Symbol("a"), State(1))
     automaton.add_transition(State(1), Symbol("a"), State(2))
@@ -32,7 +37,7 @@ def test_rpq_reachability():
 
     regex = "a*"
 
-    result = intersection_rpq(regex, graph, {0, 1, 2}, {0, 1, 2})
+    result = intersection_rpq(regex, graph, {0, 1, 2}, {0, 1, 2}, method)
 
     assert len(result) == 9
 
@@ -70,6 +75,125 @@ def test_bfs_rpq_separated_start():
     assert result == {(0, 2), (1, 2)}
 
 
+@pytest.mark.parametrize("processes", [None, 2])
+def test_bfs_rpq_returns_states(processes):
+    graph = cfpq_data.labeled_two_cycles_graph(2, 2, labels=("a", "b"))
+
+    finals = bfs_rpq("a*", graph, {0}, processes=processes)
+    pairs = bfs_rpq("a*", graph, {0}, separated_start=True, processes=processes)
+
+    assert finals == {State(0), State(1), State(2)}
+    assert all(isinstance(final, State) for final in finals)
+    assert all(isinstance(state, State) for pair in pairs for state in pair)
+
+
 def test_empty_bfs_rpq():
     graph = MultiDiGraph()
     assert bfs_rpq("abacaba", graph) == set()
+
+
+def test_bfs_rpq_separated_start_keeps_starts_apart():
+    graph = MultiDiGraph()
+    graph.add_edges_from(
+        [
+            (0, 1, {"label": "a"}),
+            (2, 3, {"label": "b"}),
+            (4, 5, {"label": "a"}),
+        ]
+    )
+    result = bfs_rpq("a", graph, {0, 2, 4}, {1, 3}, True)
+    assert result == {(0, 1)}
+
+
+def test_bfs_rpq_separated_start_without_start_nodes():
+    graph = MultiDiGraph()
+    graph.add_edges_from([(0, 1, {"label": "a"})])
+    assert bfs_rpq("a", graph, set(), None, True) == set()
+
+
+def test_rpq_shared_graph_decomposition():
+    graph = cfpq_data.labeled_two_cycles_graph(3, 3, labels=("a", "b"), common_node=0)
+    decomp = BooleanDecomposition.from_graph(graph)
+    regex = "(a|b)(aa)*"
+
+    assert intersection_rpq(regex, decomp, {0}, {1}) == intersection_rpq(
+        regex, graph, {0}, {1}
+    )
+    assert bfs_rpq(regex, decomp, {0}, {1}, True) == bfs_rpq(
+        regex, graph, {0}, {1}, True
+    )
+
+
+def test_rpq_reuses_compiled_regex():
+    graph = cfpq_data.labeled_two_cycles_graph(2, 3, labels=("a", "b"))
+    regex_cache.clear()
+
+    expected = intersection_rpq("a*.b", graph, {0}, {0, 3})
+    assert bfs_rpq("a*.b", graph, {0}, {3}) == {3}
+    assert intersection_rpq("a*.b", graph, {0}, {0, 3}) == expected == {(0, 3)}
+
+    stats = regex_cache.stats
+    assert (stats.hits, stats.misses, stats.size) == (2, 1, 1)
+
+
+@pytest.mark.parametrize("method", ["semi_naive", "scc"])
+def test_batch_rpq(method):
+    graph = cfpq_data.labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    regexes = ["a*", "a.b", "(a|b)*.b", "c", "a*"]
+
+    assert batch_rpq(regexes, graph, {0, 1}, method=method) == [
+        intersection_rpq(regex, graph, {0, 1}, method=method) for regex in regexes
+    ]
+
+
+def test_empty_batch_rpq():
+    graph = cfpq_data.labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+
+    assert batch_rpq([], graph) == []
+
+
+@pytest.mark.parametrize("separated_start", [False, True])
+def test_bfs_rpq_with_workers(separated_start):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    regex = "a*.(b.b)*"
+
+    assert bfs_rpq(
+        regex, graph, {0, 2}, separated_start=separated_start, workers=4
+    ) == bfs_rpq(regex, graph, {0, 2}, separated_start=separated_start)
+
+
+@pytest.mark.parametrize("separated_start", [False, True])
+def test_sharded_bfs_rpq(separated_start):
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    regex = "a*.(b.b)*"
+
+    assert bfs_rpq(
+        regex, graph, separated_start=separated_start, processes=2, shard_size=3
+    ) == bfs_rpq(regex, graph, separated_start=separated_start)
+
+
+def test_sharded_bfs_rpq_rejects_decomposition():
+    graph = cfpq_data.labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+
+    with pytest.raises(TypeError):
+        bfs_rpq("a", BooleanDecomposition.from_graph(graph), processes=2)
+
+
+def test_intersection_rpq_pairs():
+    graph = cfpq_data.labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+
+    pairs = intersection_rpq_pairs("a*.b", graph, {0, 1})
+    empty = intersection_rpq_pairs("c", graph)
+
+    assert len(pairs) == len(intersection_rpq("a*.b", graph, {0, 1}))
+    assert set(pairs) == intersection_rpq("a*.b", graph, {0, 1})
+    assert len(empty) == 0 and list(empty.chunks()) == []
+
+
+def test_automaton_rpq():
+    graph = cfpq_data.labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    query = BooleanDecomposition.from_fa(dfa_from_regex("a*.b"))
+
+    assert automaton_rpq(query, graph, {0, 1}) == intersection_rpq(
+        "a*.b", graph, {0, 1}
+    )